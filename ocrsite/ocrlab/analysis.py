@@ -0,0 +1,105 @@
+"""
+Analysis of binary page images: connected components, their boxes
+and the average character height.  The analysis is computed lazily,
+and shared between callers given the same page array for as long
+as that array is alive, i.e. nodes of one script evaluation reading
+the same binarizer output.  It isn't kept with the node cache, so
+a page read back from a cache file is analysed afresh.
+"""
+
+import weakref
+import threading
+
+import numpy
+
+from . import components
+
+
+# components bigger than this fraction of the page aren't text
+MAX_TEXT_AREA = 0.95
+
+
+def trimmed_mean(numpy_arr, lperc=0, hperc=0):
+    """Get a trimmed mean value from array, with low and
+    high percentage ignored."""
+    alen = len(numpy_arr)
+    return numpy_arr[(alen / 100 * lperc):
+            (alen - (alen / 100 * hperc))].mean()
+
+
+class lazy(object):
+    """Decorator for an attribute computed on first access."""
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.func(obj)
+        return value
+
+
+class PageAnalysis(object):
+    """Lazily computed measurements of a binary page, where
+    black (0) is ink.  Boxes are in top-origin coords."""
+    def __init__(self, binary):
+        # don't keep the page alive just because it's been analysed
+        self._binary = weakref.ref(binary)
+        self.shape = binary.shape
+
+    @property
+    def binary(self):
+        binary = self._binary()
+        if binary is None:
+            raise ValueError("Analysed page no longer exists")
+        return binary
+
+    @lazy
+    def ink(self):
+        """Boolean array of ink pixels."""
+        return self.binary == 0
+
+    @lazy
+    def components(self):
+        """Connected components of the ink."""
+        return components.find_components(self.ink)
+
+    @lazy
+    def boxes(self):
+        """RectArray of component bounding boxes."""
+        return self.components.rects()
+
+    @lazy
+    def text_boxes(self):
+        """Component boxes small enough to be text."""
+        return self.boxes[self.boxes.area() <=
+                self.shape[0] * self.shape[1] * MAX_TEXT_AREA]
+
+    @lazy
+    def average_char_height(self):
+        """Mean height of text boxes, ignoring the smallest and
+        largest 5%."""
+        return trimmed_mean(numpy.sort(self.text_boxes.height()), 5, 5)
+
+
+_analyses = {}
+_lock = threading.RLock()
+
+
+def get_analysis(binary):
+    """Get the analysis of a binary page array, shared by every
+    caller for as long as the array exists."""
+    key = id(binary)
+    with _lock:
+        entry = _analyses.get(key)
+        if entry is not None and entry[0]() is binary:
+            return entry[1]
+        def forget(ref):
+            with _lock:
+                if _analyses.get(key, (None,))[0] is ref:
+                    del _analyses[key]
+        analysis = PageAnalysis(binary)
+        _analyses[key] = (weakref.ref(binary, forget), analysis)
+        return analysis
@@ -0,0 +1,324 @@
+"""
+Rectangle geometry, for single boxes and for arrays of them.
+"""
+
+import numpy
+
+
+class Rectangle(object):
+    """Rectangle class, Iulib-style."""
+    def __init__(self, x0, y0, x1, y1):
+        """Initialise a rectangle."""
+        self.x0 = x0
+        self.y0 = y0
+        self.x1 = x1
+        self.y1 = y1
+
+    def __repr__(self):
+        return "<Rectangle: %d %d %d %d>" % (
+                self.x0,
+                self.y0,
+                self.x1,
+                self.y1
+        )
+
+    def __eq__(self, rect):
+        return self.x0 == rect.x0 and self.y0 == rect.y0 \
+                and self.x1 == rect.x1 and self.y1 == rect.y1
+
+    def __ne__(self, rect):
+        return self.x0 != rect.x0 or self.y0 != rect.y0 \
+                or self.x1 != rect.x1 or self.y1 != rect.y1
+
+    def aspect(self):
+        if self.empty():
+            return 1
+        return float(self.width()) / float(self.height())
+
+    def area(self):
+        if self.empty():
+            return 0
+        return self.width() * self.height()
+
+    def clone(self):
+        return Rectangle(self.x0, self.y0, self.x1, self.y1)
+
+    def empty(self):
+        return self.x0 >= self.x1 and self.y0 >= self.y1
+
+    def pad_by(self, dx, dy):
+        assert(not self.empty())
+        self.x0 -= dx
+        self.y0 -= dy
+        self.x1 += dx
+        self.y0 += dy
+
+    def shift_by(self, dx, dy):
+        assert(not self.empty())
+        self.x0 += dx
+        self.y0 += dy
+        self.x1 += dx
+        self.y0 += dy
+
+    def width(self):
+        return max(0, self.x1 - self.x0)
+
+    def height(self):
+        return max(0, self.y1 - self.y0)
+
+    def include_point(self, x, y):
+        if self.empty():
+            self.x0 = x
+            self.y0 = y
+            self.x1 = x + 1
+            self.y1 = y + 1
+        else:
+            self.x0 = min(x, self.x0)
+            self.y0 = min(y, self.y0)
+            self.x1 = max(x + 1, self.x1)
+            self.y1 = max(y + 1, self.y1)
+
+    def include(self, rect):
+        if self.empty():
+            self.x0 = rect.x0
+            self.y0 = rect.y0
+            self.x1 = rect.x1
+            self.y1 = rect.y1
+        else:
+            self.x0 = min(self.x0, rect.x0)
+            self.y0 = min(self.y0, rect.y0)
+            self.x1 = max(self.x1, rect.x1)
+            self.y1 = max(self.y1, rect.y1)
+
+    def grow(self, dx, dy):
+        return Rectangle(self.x0 - dx, self.y0 - dy,
+                self.x1 + dx, self.y1 + dy)
+
+    def overlaps(self, rect):
+        return self.x0 <= rect.x1 and self.x1 >= rect.x0 \
+                and self.y0 <= rect.y1 and self.y1 >= rect.y0
+
+    def overlaps_x(self, rect):
+        return self.x0 <= rect.x1 and self.x1 >= rect.x0
+
+    def overlaps_y(self, rect):
+        return self.y0 <= rect.y1 and self.y1 >= rect.y0
+
+    def contains(self, x, y):
+        return x >= self.x0 and x < self.x1 \
+                and y >= self.y0 and y < self.y1
+
+    def points(self):
+        return (self.x0, self.y0, self.x1, self.y1,)
+
+    def intersection(self, rect):
+        if self.empty():
+            return self
+        return Rectangle(
+                max(self.x0, rect.x0),
+                max(self.y0, rect.y0),
+                min(self.x1, rect.x1),
+                min(self.y1, rect.y1)
+        )
+
+    def inclusion(self, rect):
+        if self.empty():
+            return rect
+        return Rectangle(
+                min(self.x0, rect.x0),
+                min(self.y0, rect.y0),
+                max(self.x1, rect.x1),
+                max(self.y1, rect.y1)
+        )
+    
+    def fraction_covered_by(self, rect):
+        isect = self.intersection(rect)
+        if self.area():
+            return isect.area() / float(self.area())
+        else:
+            return -1
+
+    @classmethod
+    def union_of(cls, *args):
+        r = Rectangle(0, 0, 0, 0)
+        for arg in args:
+            r.include(arg)
+        return r
+
+
+class RectArray(object):
+    """An N x 4 array of (x0, y0, x1, y1) rectangles with the same
+    semantics as Rectangle, but where the tests and measurements
+    are done for every rectangle at once."""
+    def __init__(self, data=None):
+        """Initialise from an N x 4 array or a list of 4-tuples."""
+        if data is None:
+            data = []
+        self.data = numpy.asarray(data, dtype=numpy.int32).reshape(-1, 4)
+
+    @classmethod
+    def from_rects(cls, rects):
+        """Initialise from a sequence of Rectangles."""
+        return cls([r.points() for r in rects])
+
+    def __repr__(self):
+        return "<RectArray: %d rects>" % len(self)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        """Get a single Rectangle given an integer, or a new
+        RectArray given a slice, mask or index array."""
+        if isinstance(idx, (int, long, numpy.integer)):
+            return Rectangle(*[int(v) for v in self.data[idx]])
+        return RectArray(self.data[idx])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def x0(self):
+        return self.data[:, 0]
+
+    @property
+    def y0(self):
+        return self.data[:, 1]
+
+    @property
+    def x1(self):
+        return self.data[:, 2]
+
+    @property
+    def y1(self):
+        return self.data[:, 3]
+
+    def points(self):
+        return [tuple(p) for p in self.data.tolist()]
+
+    def empty(self):
+        return (self.x0 >= self.x1) & (self.y0 >= self.y1)
+
+    def width(self):
+        return numpy.maximum(0, self.x1 - self.x0)
+
+    def height(self):
+        return numpy.maximum(0, self.y1 - self.y0)
+
+    def area(self):
+        return numpy.where(self.empty(), 0, self.width() * self.height())
+
+    def aspect(self):
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            aspect = self.width() / self.height().astype(numpy.float64)
+        return numpy.where(self.empty(), 1.0, aspect)
+
+    def grow(self, dx, dy):
+        return RectArray(self.data + numpy.array([-dx, -dy, dx, dy]))
+
+    def overlaps(self, rect):
+        return self.overlaps_x(rect) & self.overlaps_y(rect)
+
+    def overlaps_x(self, rect):
+        return (self.x0 <= rect.x1) & (self.x1 >= rect.x0)
+
+    def overlaps_y(self, rect):
+        return (self.y0 <= rect.y1) & (self.y1 >= rect.y0)
+
+    def flipud(self, height):
+        """Get the rects flipped vertically in an image of the
+        given height, i.e. between top- and bottom-origin coords."""
+        return RectArray(numpy.column_stack((self.x0, height - self.y1,
+                self.x1, height - self.y0)))
+
+    def sort_by(self, values):
+        """Get the rects sorted (stably) by the given values."""
+        return self[numpy.argsort(values, kind="mergesort")]
+
+    def union(self):
+        """Get the union of all the rects, as a Rectangle.  This is
+        the same as Rectangle.union_of(*rects), which ignores empty
+        rects until it has found one that isn't."""
+        if not len(self):
+            return Rectangle(0, 0, 0, 0)
+        nonempty = numpy.flatnonzero(~self.empty())
+        if not len(nonempty):
+            return self[-1]
+        rest = self.data[nonempty[0]:]
+        return Rectangle(int(rest[:, 0].min()), int(rest[:, 1].min()),
+                int(rest[:, 2].max()), int(rest[:, 3].max()))
+
+
+class IntervalIndex(object):
+    """Index over the y-extents of a RectArray which finds the rects
+    overlapping vertically with a given one by bisection, rather than
+    by testing every rect.  Rects are sorted by y0; since none is
+    taller than the tallest, only those starting within that
+    distance above a query can reach it."""
+    def __init__(self, rects):
+        self.rects = rects
+        self.order = numpy.argsort(rects.y0, kind="mergesort")
+        self.starts = rects.y0[self.order]
+        self.maxheight = int(rects.height().max()) if len(rects) else 0
+
+    def overlaps_y(self, rect):
+        """Get the (ascending) indices of the rects which overlap
+        vertically with rect."""
+        lo = numpy.searchsorted(self.starts, rect.y0 - self.maxheight, "left")
+        hi = numpy.searchsorted(self.starts, rect.y1, "right")
+        found = self.order[lo:hi]
+        found = found[self.rects.y1[found] >= rect.y0]
+        found.sort()
+        return found
+
+    def overlaps(self, rect):
+        """Get the (ascending) indices of the rects which overlap
+        with rect."""
+        found = self.overlaps_y(rect)
+        return found[self.rects[found].overlaps_x(rect)]
+
+
+def random_page(numrects, width=2500, height=3500, seed=0):
+    """Make a RectArray of character-like boxes laid out in lines,
+    roughly like the components on a page of text."""
+    rand = numpy.random.RandomState(seed)
+    linecount = max(1, height / 40)
+    lines = rand.randint(0, linecount, numrects)
+    x0 = rand.randint(0, width - 20, numrects)
+    y0 = lines * 40 + rand.randint(0, 8, numrects)
+    return RectArray(numpy.column_stack((x0, y0,
+            x0 + rand.randint(4, 20, numrects),
+            y0 + rand.randint(10, 30, numrects))))
+
+
+def benchmark(sizes=(1000, 10000, 100000), numqueries=200):
+    """Time vertical overlap queries against synthetic pages, with a
+    Python scan (as horizontal_overlaps used to do), a vectorized
+    scan and the interval index."""
+    import time
+    for size in sizes:
+        rects = random_page(size)
+        queries = [rects[i] for i in range(0, size, max(1, size / numqueries))]
+        rectlist = list(rects)
+        def scan():
+            for q in queries[:20]:
+                [r for r in rectlist if q.overlaps_y(r)]
+        def vectorized():
+            for q in queries:
+                numpy.flatnonzero(rects.overlaps_y(q))
+        def indexed():
+            index = IntervalIndex(rects)
+            for q in queries:
+                index.overlaps_y(q)
+        for func, count in ((scan, 20), (vectorized, len(queries)),
+                (indexed, len(queries))):
+            start = time.time()
+            func()
+            secs = (time.time() - start) / count * len(queries)
+            print "%7d rects, %d queries: %-10s %0.4fs" % (
+                    size, len(queries), func.__name__, secs)
+
+
+if __name__ == "__main__":
+    benchmark()
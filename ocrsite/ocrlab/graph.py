@@ -1,13 +1,23 @@
 """
 Utility class for displaying node scripts.
+
+Node positions are worked out with a simple layered (Sugiyama-style)
+layout, in-process: nodes are assigned to layers by the longest path
+from the script's inputs, ordered within each layer to reduce edge
+crossings, and spaced out like dot would, with the inputs at the top.
+Graphviz can still be used instead, if pydot is installed.  Layouts
+are cached by the structure of the script, so redrawing an unchanged
+script is free.
 """
 
 import os
 import re
 import sys
-import pydot
 import json
+import hashlib
 import tempfile
+import threading
+from collections import OrderedDict
 
 class DotError(StandardError):
     """Dot problems."""
@@ -16,59 +26,250 @@ class DotError(StandardError):
 # http://www.graphviz.org/doc/info/lang.html
 RAW_NAME_RE = r"(^[A-Za-z_][a-zA-Z0-9_]*$)|(^-?([.[0-9]+|[0-9]+(.[0-9]*)?)$)"
 
+# Layout dimensions, in points, matching the dot settings
+# below: 0.5in nodes, 0.7in between ranks, 1.5in between nodes.
+NODE_SIZE = 36
+RANK_SEP = 50
+NODE_SEP = 108
+MARGIN = 4
+
+# Number of ordering sweeps, up and down the layers.
+SWEEPS = 8
+
+# Number of layouts to keep.
+CACHE_SIZE = 256
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
 
 def conditional_quote(name):
     if re.match(RAW_NAME_RE, name) is None:
         return "\"%s\"" % name
     return name
 
-def get_node_positions(nodedict, aspect=None):
-    """
-    Build the pydot graph.
-    """
+
+def get_edges(nodedict):
+    """Get the (input, node) edges of a node dict, ignoring
+    inputs which aren't in it."""
+    edges = []
+    for name in sorted(nodedict):
+        for i in nodedict[name].get("inputs", []):
+            if i in nodedict:
+                edges.append((i, name))
+    return edges
+
+
+def get_layers(names, edges):
+    """Assign each node to a layer, by the length of the longest
+    path to it from a node with no inputs.  Edges which would make
+    a cycle are ignored."""
+    inputs = dict((name, []) for name in names)
+    for src, dst in edges:
+        inputs[dst].append(src)
+    layers, visiting = {}, set()
+    def layer(name):
+        if name not in layers:
+            visiting.add(name)
+            deps = [layer(i) for i in inputs[name] if i not in visiting]
+            visiting.discard(name)
+            layers[name] = max(deps) + 1 if deps else 0
+        return layers[name]
+    for name in names:
+        layer(name)
+    return layers
+
+
+def add_dummies(layers, edges):
+    """Split edges which span several layers with dummy nodes, one
+    per layer crossed, so they're taken into account when ordering.
+    Returns the edges between adjacent layers."""
+    out = []
+    for src, dst in edges:
+        if layers[dst] <= layers[src]:
+            src, dst = dst, src
+        if layers[src] == layers[dst]:
+            continue
+        prev = src
+        for l in range(layers[src] + 1, layers[dst]):
+            dummy = ("dummy", src, dst, l)
+            layers[dummy] = l
+            out.append((prev, dummy))
+            prev = dummy
+        out.append((prev, dst))
+    return out
+
+
+def count_crossings(ranks, edges, layers):
+    """Count the edge crossings between adjacent layers."""
+    pos = dict((n, i) for rank in ranks for i, n in enumerate(rank))
+    bylayer = {}
+    for src, dst in edges:
+        bylayer.setdefault(layers[src], []).append((pos[src], pos[dst]))
+    count = 0
+    for pairs in bylayer.itervalues():
+        for i, (a0, a1) in enumerate(pairs):
+            for b0, b1 in pairs[i + 1:]:
+                if (a0 - b0) * (a1 - b1) < 0:
+                    count += 1
+    return count
+
+
+def order_layers(layers, edges):
+    """Order the nodes within each layer to reduce crossings, by
+    repeatedly sorting each by the mean position of its neighbours
+    in the layer above, then below."""
+    ranks = [[] for _ in range(max(layers.values()) + 1)]
+    for n in sorted(layers, key=lambda n: (isinstance(n, tuple), n)):
+        ranks[layers[n]].append(n)
+    up, down = {}, {}
+    for src, dst in edges:
+        down.setdefault(src, []).append(dst)
+        up.setdefault(dst, []).append(src)
+    def sweep(ranks, order, neighbours):
+        pos = dict((n, i) for rank in ranks for i, n in enumerate(rank))
+        for r in order:
+            def barycenter(n):
+                near = neighbours.get(n)
+                if not near:
+                    return pos[n]
+                return float(sum(pos[m] for m in near)) / len(near)
+            ranks[r] = sorted(ranks[r], key=barycenter)
+            pos.update((n, i) for i, n in enumerate(ranks[r]))
+    best, fewest = [list(r) for r in ranks], count_crossings(ranks, edges, layers)
+    for i in range(SWEEPS):
+        if i % 2 == 0:
+            sweep(ranks, range(1, len(ranks)), up)
+        else:
+            sweep(ranks, range(len(ranks) - 2, -1, -1), down)
+        crossings = count_crossings(ranks, edges, layers)
+        if crossings < fewest:
+            best, fewest = [list(r) for r in ranks], crossings
+        if not fewest:
+            break
+    return best
+
+
+def place_nodes(ranks, edges):
+    """Get the x coordinate of every node.  Each layer starts out
+    centred, then, sweeping down and up the layers, nodes are moved
+    to the mean position of their neighbours in the layer before,
+    keeping them in order and apart.  The last sweep is upwards, so
+    nodes end up centred over their outputs, as in dot."""
+    step = NODE_SIZE + NODE_SEP
+    width = max(len(rank) for rank in ranks)
+    x = {}
+    for rank in ranks:
+        offset = (width - len(rank)) * step / 2.0
+        for i, n in enumerate(rank):
+            x[n] = offset + i * step
+    up, down = {}, {}
+    for src, dst in edges:
+        down.setdefault(src, []).append(dst)
+        up.setdefault(dst, []).append(src)
+    def sweep(order, neighbours):
+        for rank in order:
+            want = [float(sum(x[m] for m in neighbours[n])) / len(neighbours[n])
+                    if neighbours.get(n) else x[n] for n in rank]
+            # keep the order, and at least a step apart, either way
+            for i in range(1, len(rank)):
+                want[i] = max(want[i], want[i - 1] + step)
+            for i in range(len(rank) - 2, -1, -1):
+                want[i] = min(want[i], want[i + 1] - step)
+            x.update(zip(rank, want))
+    for _ in range(SWEEPS / 2):
+        sweep(ranks[1:], up)
+        sweep(ranks[-2::-1], down)
+    left = min(x.itervalues())
+    return dict((n, pos - left) for n, pos in x.iteritems())
+
+
+def layered_layout(nodedict):
+    """Get node positions as [x, y] points, with y increasing up
+    the page as in Graphviz, without calling out to Graphviz."""
+    names = sorted(nodedict)
+    if not names:
+        return {}
+    edges = get_edges(nodedict)
+    layers = get_layers(names, edges)
+    edges = add_dummies(layers, edges)
+    ranks = order_layers(layers, edges)
+    x = place_nodes(ranks, edges)
+    top = len(ranks) - 1
+    half = NODE_SIZE / 2 + MARGIN
+    return dict((name, [int(x[name]) + half,
+            (top - layers[name]) * (NODE_SIZE + RANK_SEP) + half])
+            for name in names)
+
+
+def dot_layout(nodedict, aspect=None):
+    """Get node positions from Graphviz's dot, via pydot."""
+    try:
+        import pydot
+    except ImportError:
+        raise DotError("Graphviz layout needs pydot to be installed.")
     g = pydot.Dot(margin="0.1", ranksep="0.7", nodesep="1.5")
     if aspect is not None:
         g.set_aspect(round(aspect))
-    for name, node in nodedict.iteritems():
-        n = pydot.Node(name, width="0.5", fixedsize="0.5")
-        g.add_node(n)
-
-    for name, node in nodedict.iteritems():
-        for i in node["inputs"]:
-            try:
-                src = g.get_node(conditional_quote(i))
-                if isinstance(src, list):
-                    src = src[0]
-                dst = g.get_node(conditional_quote(name))
-                if isinstance(dst, list):
-                    dst = dst[0]
-                g.add_edge(pydot.Edge(src, dst))
-            except IndexError:
-                print "Input %s not found" % i
-    
-    # dot doesn't seem to work on < 4 nodes... prevent it from
-    # by just throwing an error
-    if len(nodedict) < 4:
-        raise DotError("Dot breaks with less than 4 nodes.")
+    for name in nodedict:
+        g.add_node(pydot.Node(name, width="0.5", fixedsize="0.5"))
+    for src, dst in get_edges(nodedict):
+        g.add_edge(pydot.Edge(conditional_quote(src), conditional_quote(dst)))
 
     with tempfile.NamedTemporaryFile(delete=False, suffix=".dot") as t:
         t.close()
+    try:
         g.write_dot(t.name)
-    g = pydot.graph_from_dot_file(t.name)
-    print "Wrote dot file %s" % t.name
+        g = pydot.graph_from_dot_file(t.name)
+    finally:
+        os.unlink(t.name)
 
     out = {}
-    for name, node in nodedict.iteritems():
+    for name in nodedict:
         gn = g.get_node(conditional_quote(name))
         if isinstance(gn, list):
             gn = gn[0]
         out[name] = [int(float(d)) \
                 for d in gn.get_pos().replace('"', "").split(",")]
     return out
-   
+
+
+def get_layout_key(nodedict, aspect=None, engine="layered"):
+    """Hash the structure of a script, i.e. its node names and
+    their inputs, which is all that affects its layout."""
+    structure = [(name, list(nodedict[name].get("inputs", [])))
+            for name in sorted(nodedict)]
+    return hashlib.md5(json.dumps([engine, aspect, structure])).hexdigest()
+
+
+def get_node_positions(nodedict, aspect=None, engine="layered"):
+    """
+    Get the [x, y] position of each node in a script, with the
+    layered layout or, if engine is "dot", with Graphviz.  Dot
+    doesn't work on less than 4 nodes, so small scripts always
+    use the layered layout.  The aspect ratio only affects dot.
+    """
+    if engine == "dot" and len(nodedict) < 4:
+        engine = "layered"
+    key = get_layout_key(nodedict, aspect, engine)
+    with _lock:
+        out = _cache.pop(key, None)
+        if out is not None:
+            _cache[key] = out
+    if out is None:
+        if engine == "dot":
+            out = dot_layout(nodedict, aspect)
+        else:
+            out = layered_layout(nodedict)
+        with _lock:
+            _cache[key] = out
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return dict((name, list(pos)) for name, pos in out.iteritems())
+
+
 if __name__ == "__main__":
     nodes = {}
     with open(sys.argv[1], "r") as f:
         nodes = json.load(f)
     print get_node_positions(nodes)
-
@@ -0,0 +1,214 @@
+"""
+Streaming hOCR serializer.  This produces exactly the same output
+as the old templates/hocr_template.html Django template, but the
+markup is compiled once at import time, Django doesn't need to be
+configured, and lines can be written out as they are recognized.
+"""
+
+import re
+import codecs
+from io import StringIO
+
+import lxml.html
+
+
+DOC_HEADER = u"""<?xml version='1.0' encoding='UTF-8'?>
+<!DOCTYPE html 
+     PUBLIC '-//W3C//DTD XHTML 1.0 Strict//EN'
+    'http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd'>
+<html xmlns='http://www.w3.org/1999/xhtml'>
+<head>
+    <meta name='ocr-id' value='%(ocrid)s'>
+    <meta name='ocr-recognized' value='lines text'>
+    <meta name='DC.creator' value='%(dc_creator)s'>
+    <meta name='DC.title' value='%(dc_title)s'>
+    <meta name='DC.publisher' value='%(dc_publisher)s'>
+</head>
+<body>
+    """
+
+PAGE_HEADER = u"""<div class='ocr_page' id='page_1' title='file %(file)s; bbox %(bbox)s'>
+        """
+
+HEADER = DOC_HEADER + PAGE_HEADER
+
+LINE = u"<span class='ocr_line' id='line_%s' title='bbox %s'>%s<br></span>\n        "
+
+PAGE_FOOTER = u"""
+    </div>"""
+
+DOC_FOOTER = u"""
+</body>
+</html>
+"""
+
+FOOTER = PAGE_FOOTER + DOC_FOOTER
+
+META = ("ocrid", "dc_creator", "dc_title", "dc_publisher", "file")
+
+BBOX_RE = re.compile(r"\bbbox\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)")
+
+
+def escape(value):
+    """Convert a value to escaped unicode, the same way Django's
+    autoescaping does."""
+    return unicode(value).replace(u"&", u"&amp;").replace(u"<", u"&lt;")\
+            .replace(u">", u"&gt;").replace(u'"', u"&quot;")\
+            .replace(u"'", u"&#39;")
+
+
+def format_value(data, key):
+    """Format an item of a dict or list.  As in a template, missing
+    values are rendered as an empty string."""
+    try:
+        return escape(data[key])
+    except (KeyError, IndexError, TypeError):
+        return u""
+
+
+def format_bbox(data):
+    """Format the bbox of a page or line dict."""
+    bbox = data.get("bbox")
+    return u" ".join([format_value(bbox, i) for i in range(4)])
+
+
+def format_header(pagedata):
+    """Format everything before the first line of a page."""
+    values = dict((key, format_value(pagedata, key)) for key in META)
+    values.update(bbox=format_bbox(pagedata))
+    return HEADER % values
+
+
+class HocrWriter(object):
+    """Write an hOCR page to a file-like object a line at a time.
+    If an encoding is given the output is encoded before being
+    written, i.e. for writing to a socket."""
+    def __init__(self, handle, encoding=None):
+        if encoding is not None:
+            handle = codecs.getwriter(encoding)(handle)
+        self.handle = handle
+
+    def write_header(self, pagedata):
+        """Write everything before the first line."""
+        self.handle.write(format_header(pagedata))
+
+    def write_line(self, line):
+        """Write a single line dict with index, bbox and text."""
+        self.handle.write(LINE % (format_value(line, "index"),
+                format_bbox(line), format_value(line, "text")))
+
+    def write_footer(self):
+        """Write everything after the last line."""
+        self.handle.write(FOOTER)
+
+    def write(self, pagedata):
+        """Write a whole page."""
+        self.write_header(pagedata)
+        for line in pagedata.get("lines", []):
+            self.write_line(line)
+        self.write_footer()
+
+
+def hocr_from_data(pagedata):
+    """Return an hOCR document (as a string)."""
+    buf = StringIO()
+    HocrWriter(buf).write(pagedata)
+    return buf.getvalue()
+
+
+def parse(hocrstr):
+    """Parse an hOCR document into an lxml tree."""
+    if isinstance(hocrstr, unicode):
+        hocrstr = hocrstr.encode("utf8")
+    parser = lxml.html.HTMLParser(encoding="utf-8")
+    return lxml.html.document_fromstring(hocrstr, parser=parser)
+
+
+def shift_bboxes(element, dx, dy):
+    """Offset the bbox of an element and all its descendants."""
+    def shift(match):
+        x0, y0, x1, y1 = [int(v) for v in match.groups()]
+        return "bbox %d %d %d %d" % (x0 + dx, y0 + dy, x1 + dx, y1 + dy)
+    for el in element.iter():
+        title = el.get("title")
+        if title is not None:
+            el.set("title", BBOX_RE.sub(shift, title))
+
+
+def renumber_ids(element, counters):
+    """Renumber the ids of an element and its descendants, i.e.
+    line_1, line_2, using a running count for each prefix."""
+    for el in element.iter():
+        elid = el.get("id")
+        if elid is None:
+            continue
+        prefix = elid.rsplit("_", 1)[0]
+        counters[prefix] = counters.get(prefix, 0) + 1
+        el.set("id", "%s_%d" % (prefix, counters[prefix]))
+
+
+def merge_columns(hocrlist, offsets, pagedata):
+    """Merge hOCR documents representing the columns of a page
+    into a single page, in order.  Each column's bboxes are
+    offset by its (dx, dy) position on the page, and element ids
+    are renumbered so they're unique within the page."""
+    counters = {}
+    parts = [format_header(pagedata)]
+    for hocrstr, (dx, dy) in zip(hocrlist, offsets):
+        for page in parse(hocrstr).find_class("ocr_page"):
+            for child in page.iterchildren(tag=lxml.html.etree.Element):
+                shift_bboxes(child, dx, dy)
+                renumber_ids(child, counters)
+                parts.append(lxml.html.tostring(child, encoding=unicode,
+                        with_tail=False))
+                parts.append(u"\n        ")
+    parts.append(FOOTER)
+    return u"".join(parts)
+
+
+def concatenate(hocrlist, docdata=None):
+    """Join hOCR documents, each of one or more pages, into a
+    single document with their pages in order.  Page, line and
+    other element ids are renumbered to be unique within it.  The
+    document metadata is taken from docdata, if given."""
+    counters = {}
+    values = dict((key, format_value(docdata or {}, key)) for key in META)
+    parts = [DOC_HEADER % values]
+    for hocrstr in hocrlist:
+        for page in parse(hocrstr).find_class("ocr_page"):
+            renumber_ids(page, counters)
+            parts.append(lxml.html.tostring(page, encoding=unicode,
+                    with_tail=False))
+            parts.append(u"\n    ")
+    parts.append(DOC_FOOTER)
+    return u"".join(parts)
+
+
+def benchmark(numlines=10000, repeat=5):
+    """Time serializing a page with numlines lines, and compare with
+    rendering the old Django template."""
+    import os
+    import timeit
+    from django.conf import settings
+    from django.template import Template, Context
+    if not settings.configured:
+        settings.configure()
+    pagedata = dict(bbox=[0, 0, 2480, 3508], lines=[
+        dict(index=i + 1, bbox=[100, i * 20, 2000, i * 20 + 18],
+            text=u"Line %d & <some> 'text' \u00e9" % i)
+        for i in range(numlines)])
+    with open(os.path.join(os.path.dirname(__file__),
+            "templates", "hocr_template.html"), "r") as tmpl:
+        source = tmpl.read()
+    def django():
+        return unicode(Template(source).render(Context(pagedata)))
+    def writer():
+        return hocr_from_data(pagedata)
+    assert django() == writer(), "Output differs from template"
+    for func in (django, writer):
+        secs = min(timeit.repeat(func, number=1, repeat=repeat))
+        print "%s: %d lines in %0.3fs" % (func.__name__, numlines, secs)
+
+
+if __name__ == "__main__":
+    benchmark()
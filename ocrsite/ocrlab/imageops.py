@@ -0,0 +1,239 @@
+"""
+Simple image transforms: crop, scale, rotate and grayscale
+conversion.  Each node which does one of these describes it as an
+op tuple, and runs of such nodes are fused by the optimize pass so
+that the last one applies the whole list in one go.  Crops and
+rotations are done as numpy views where possible, the image is
+converted to grayscale at most once, and a nearest-neighbour scale
+followed by a crop only computes the pixels which are kept.
+Input nodes can also be given the ops of the nodes they feed, and
+decode only as much of the file as those need.
+"""
+
+import io
+import os
+
+import numpy
+from PIL import Image
+
+
+def crop(x0=-1, y0=-1, x1=-1, y1=-1):
+    """Crop to a box.  Coordinates which are -1 or less
+    mean the edge of the image."""
+    return ("crop", x0, y0, x1, y1)
+
+
+def scale(factor, filter="NEAREST"):
+    """Scale by the given factor with a PIL filter name."""
+    return ("scale", float(factor), filter)
+
+
+def resize(size, filter="NEAREST"):
+    """Scale to an exact (width, height)."""
+    return ("resize", tuple(size), filter)
+
+
+def rotate(num):
+    """Rotate num*90 degrees counter-clockwise."""
+    return ("rotate", int(num))
+
+
+def gray():
+    """Convert to grayscale."""
+    return ("gray",)
+
+
+# ops whose result is always an 8-bit grayscale image
+GRAY_OPS = ("crop", "scale", "resize", "gray")
+
+TRANSPOSE = {1: Image.ROTATE_90, 2: Image.ROTATE_180, 3: Image.ROTATE_270}
+
+
+def get_crop_box(op, width, height):
+    """Get the actual (x0, y0, x1, y1) of a crop op for an image of
+    the given size, clipped to the image as numpy slicing would."""
+    box = []
+    for value, edge, size in zip(op[1:], (0, 0, width, height),
+            (width, height, width, height)):
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            value = -1
+        box.append(min(size, edge if value < 0 else value))
+    x0, y0, x1, y1 = box
+    return x0, y0, max(x0, x1), max(y0, y1)
+
+
+def get_size(image):
+    """Get the (width, height) of a numpy or PIL image."""
+    if isinstance(image, numpy.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+
+def to_pil(image):
+    if isinstance(image, numpy.ndarray):
+        return Image.fromarray(image)
+    return image
+
+
+def is_gray(image):
+    if isinstance(image, numpy.ndarray):
+        return image.ndim == 2 and image.dtype == numpy.uint8
+    return image.mode == "L"
+
+
+def is_bilevel(image):
+    if isinstance(image, numpy.ndarray):
+        return image.dtype == numpy.bool_
+    return image.mode == "1"
+
+
+def run(image, ops):
+    """Apply a list of ops to a numpy or PIL image, in order,
+    returning a numpy image."""
+    if not isinstance(image, Image.Image):
+        image = numpy.asarray(image)
+    # crops and rotations don't change pixel values, so the
+    # conversion is left until just before a nearest-neighbour
+    # scale, or the end, when there are fewest pixels.  Other
+    # filters mix pixels, and PIL only ever scales bilevel images
+    # nearest-neighbour, so those are scaled before converting,
+    # as they would be without fusing
+    convert = any(op[0] in GRAY_OPS for op in ops) and not is_gray(image)
+    ops = list(ops)
+    while ops:
+        op = ops.pop(0)
+        width, height = get_size(image)
+        if op[0] == "crop":
+            x0, y0, x1, y1 = get_crop_box(op, width, height)
+            if isinstance(image, numpy.ndarray):
+                image = image[y0:y1, x0:x1]
+            else:
+                image = image.crop((x0, y0, x1, y1))
+        elif op[0] == "rotate":
+            num = op[1] % 4
+            if isinstance(image, numpy.ndarray):
+                image = numpy.rot90(image, num)
+            elif num:
+                image = image.transpose(TRANSPOSE[num])
+        elif op[0] in ("scale", "resize"):
+            if convert and op[2] == "NEAREST" and not is_bilevel(image):
+                image, convert = to_pil(image).convert("L"), False
+            if op[0] == "resize":
+                size = op[1]
+            else:
+                size = int(width * op[1]), int(height * op[1])
+            filter = getattr(Image, op[2])
+            if ops and ops[0][0] == "crop" and op[2] == "NEAREST" \
+                    and width and height:
+                image = scale_crop(image, size,
+                        get_crop_box(ops.pop(0), *size))
+            else:
+                image = to_pil(image).resize(size, filter)
+    if convert:
+        image = to_pil(image).convert("L")
+    return numpy.asarray(image)
+
+
+def nearest_indices(length, size):
+    """Get the source index of each pixel when PIL scales a row of
+    the given length to size pixels nearest-neighbour, by scaling a
+    row of the indices themselves."""
+    row = numpy.arange(length, dtype=numpy.int32).reshape(1, length)
+    return numpy.asarray(Image.fromarray(row).resize(
+            (size, 1), Image.NEAREST))[0]
+
+
+def scale_crop(image, size, box):
+    """Get a crop of a nearest-neighbour scaled image, only computing
+    the pixels within the crop box, exactly as PIL would."""
+    x0, y0, x1, y1 = box
+    width, height = get_size(image)
+    xs = nearest_indices(width, size[0])[x0:x1]
+    ys = nearest_indices(height, size[1])[y0:y1]
+    return numpy.asarray(image)[ys[:, numpy.newaxis], xs]
+
+
+def overlaps(box, other):
+    return box[0] < other[2] and other[0] < box[2] \
+            and box[1] < other[3] and other[1] < box[3]
+
+
+def is_path(source):
+    """Whether an input source is a file path, rather than a file
+    object or the file's data.  Paths can't contain NUL bytes,
+    whereas image data always does."""
+    return isinstance(source, basestring) and "\0" not in source
+
+
+def is_missing(source):
+    """Whether an input source is a path to a file which
+    doesn't exist."""
+    return is_path(source) and not os.path.exists(source)
+
+
+def get_source(source):
+    """Get something PIL can open from an input source: a path, a
+    file object (including a Django upload, which is read from its
+    temporary file if it has one), or a buffer of file data."""
+    if hasattr(source, "temporary_file_path"):
+        return source.temporary_file_path()
+    if isinstance(source, (bytearray, buffer, memoryview)) or (
+            isinstance(source, str) and not is_path(source)):
+        return io.BytesIO(source)
+    return source
+
+
+def open_image(fp):
+    """Open an image from an input source (see get_source), which
+    may have been read before."""
+    fp = get_source(fp)
+    if hasattr(fp, "seek"):
+        fp.seek(0)
+    return Image.open(fp)
+
+
+def count_pages(fp):
+    """Get the number of pages (frames) in an image file, without
+    decoding any of them."""
+    pil = open_image(fp)
+    count = getattr(pil, "n_frames", None)
+    if count is None:
+        count = 1
+        try:
+            while True:
+                pil.seek(count)
+                count += 1
+        except EOFError:
+            pass
+    return count
+
+
+def decode(fp, ops=(), as_gray=False, page=0):
+    """Read an image from an input source and apply ops to
+    it, converting it to grayscale if as_gray is set and decoding
+    only what the ops need.  If the first op is a scale,
+    JPEGs are decoded at the smallest reduced resolution (1/2, 1/4
+    or 1/8) still at least as big as the result, which is then
+    resized to the exact size.  If the first op is a crop, images
+    stored in strips or tiles (i.e. TIFFs) only decode those which
+    overlap it.  For multi-page files, only the given page is
+    decoded.  Returns a numpy image."""
+    pil = open_image(fp)
+    if page:
+        pil.seek(page)
+    ops = list(ops)
+    if as_gray and not any(op[0] in GRAY_OPS for op in ops):
+        ops.append(gray())
+    as_gray = any(op[0] in GRAY_OPS for op in ops)
+    if ops and ops[0][0] == "scale":
+        width, height = pil.size
+        size = int(width * ops[0][1]), int(height * ops[0][1])
+        pil.draft("L" if as_gray else pil.mode, size)
+        if pil.size != (width, height):
+            ops[0] = resize(size, ops[0][2])
+    elif ops and ops[0][0] == "crop" and len(pil.tile) > 1:
+        box = get_crop_box(ops[0], *pil.size)
+        pil.tile = [t for t in pil.tile if overlaps(t[1], box)]
+    return run(pil, ops)
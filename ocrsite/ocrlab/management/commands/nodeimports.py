@@ -0,0 +1,33 @@
+"""
+Report what importing each node backend costs.
+"""
+
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from ocrlab import nodes
+
+
+class Command(BaseCommand):
+    args = "[<backend1> ... <backendN>]"
+    help = "Import node backends, reporting the time each takes."
+
+    def handle(self, *args, **options):
+        names = args or sorted(nodes.BACKENDS)
+        for name in names:
+            if name not in nodes.BACKENDS:
+                raise CommandError("Unknown backend: %s" % name)
+        # modules shared between backends are counted against
+        # the first one to import them
+        for name in names:
+            before = set(sys.modules)
+            start = time.time()
+            try:
+                nodes.load(name)
+            except ImportError, err:
+                self.stdout.write("%-10s unavailable: %s\n" % (name, err))
+                continue
+            self.stdout.write("%-10s %7.3fs %4d modules  (%s)\n" % (name,
+                    time.time() - start, len(set(sys.modules) - before),
+                    nodes.BACKENDS[name]["description"]))
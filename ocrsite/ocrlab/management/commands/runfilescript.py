@@ -11,7 +11,7 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ImproperlyConfigured
 from django.utils import simplejson as json
 
-from ocrlab import models, stages, nodes
+from ocrlab import models, stages, nodes, optimize
 from nodetree import script, registry
 
 class Command(BaseCommand):
@@ -28,16 +28,17 @@ class Command(BaseCommand):
 
         try:
             with open(scriptfile, "r") as f:
-                nodes = json.load(f)
+                nodelist = json.load(f)
         except Exception:
             raise CommandError("Invalid script file: %s" % scriptfile)
-        if nodes is None:
+        if nodelist is None:
             raise CommandError("No nodes found in script: %s" % scriptfile)
 
-        s = script.Script(nodes)
+        s = script.Script(nodes.load_for_script(nodelist))
         input = s.get_nodes_by_attr("stage", stages.INPUT)[0]
         input.set_param("path", infile)
 
+        optimize.optimize(s)
         term = s.get_terminals()[0]
         sys.stderr.write("Rendering to %s\n" % outfile)
         os.environ["NODETREE_WRITE_FILEOUT"] = "1"
@@ -0,0 +1,77 @@
+"""
+Process-wide registry of loaded recognition models.  Native
+models (character models, language FSTs) are expensive to load,
+so they are loaded once per worker process and shared by every
+node that uses them.
+"""
+
+import os
+import time
+import logging
+import resource
+import threading
+
+
+def get_rss():
+    """Get the resident memory size of this process, in bytes."""
+    try:
+        with open("/proc/self/statm", "r") as fh:
+            return int(fh.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        # ru_maxrss is a peak value in KB, but it's the best we can do
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ModelRegistry(object):
+    """Cache of loaded models keyed by loader, path and mtime."""
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, loader):
+        """Get the model at path, loading it with loader(path) if it
+        has not yet been loaded or has changed on disk since."""
+        path = os.path.abspath(path)
+        key = (loader.__name__, path, os.path.getmtime(path))
+        with self._lock:
+            if key not in self._models:
+                self._evict(key)
+                self._models[key] = self._load(key, path, loader)
+            return self._models[key]
+
+    def _load(self, key, path, loader):
+        """Load a model, recording how long it took and how much
+        memory it uses."""
+        rss = get_rss()
+        start = time.time()
+        model = loader(path)
+        stats = dict(loader=key[0], path=path,
+                loadtime=time.time() - start,
+                memory=max(0, get_rss() - rss))
+        self._stats[key] = stats
+        self.logger.info("Loaded model %s in %0.2fs (%d KB)", path,
+                stats["loadtime"], stats["memory"] / 1024)
+        return model
+
+    def _evict(self, key):
+        """Drop older versions of the model in key."""
+        for other in self._models.keys():
+            if other[:2] == key[:2]:
+                del self._models[other]
+                del self._stats[other]
+
+    def stats(self):
+        """Get load time and memory info for loaded models."""
+        with self._lock:
+            return sorted(self._stats.values(), key=lambda s: s["path"])
+
+    def clear(self):
+        """Unload everything."""
+        with self._lock:
+            self._models.clear()
+            self._stats.clear()
+
+
+registry = ModelRegistry()
@@ -44,8 +44,11 @@ class Profile(BaseModel, NameSlugModel, DateTimeModel):
     tags = TaggableManager()
 
     def validate_preset(self, data):
+        # imported here so loading the models doesn't
+        # import the node modules
+        from .. import nodes
         this = json.loads(self.data)
-        tree = script.Script(data)
+        tree = script.Script(nodes.load_for_script(data))
         errors = []
         for name, preds in this.iteritems():
             for pred in preds:
@@ -1,6 +1,67 @@
+"""
+Node modules.  The core modules are imported with the package, but
+backends which need native libraries or optional packages are only
+imported when a script uses one of their nodes, so web processes
+and management commands don't pay for the ones they never use.
+Call load_for_script() on a script's data before building it.
+"""
 
 from __future__ import absolute_import
 
-from . import ( abbyy, ocropus, tesseract, util,
-                numpy, pil, ocrlab, cuneiform, web,
-                fedora) #, storage)
+import sys
+import time
+import threading
+import importlib
+
+from . import util, numpy, pil
+
+
+# Backends imported on demand, with a description and the
+# third-party modules they pull in.
+BACKENDS = {
+    "abbyy": dict(description="ABBYY FineReader CLI recognizer",
+        requires=()),
+    "cuneiform": dict(description="Cuneiform recognizer",
+        requires=()),
+    "fedora": dict(description="Fedora Commons repository input",
+        requires=("eulfedora", "ocrolib")),
+    "ocrlab": dict(description="Experimental segmentation and filters",
+        requires=("ocrolib",)),
+    "ocropus": dict(description="Ocropus components and recognizer",
+        requires=("ocrolib",)),
+    "tesseract": dict(description="Tesseract recognizer",
+        requires=("ocrolib",)),
+    "web": dict(description="Web service nodes",
+        requires=("httplib2", "BeautifulSoup")),
+}
+
+# How long each backend took to import, in seconds.
+import_times = {}
+
+_lock = threading.RLock()
+
+
+def load(name):
+    """Get a backend module, importing it if necessary."""
+    modname = "%s.%s" % (__name__, name)
+    module = sys.modules.get(modname)
+    if module is None:
+        with _lock:
+            start = time.time()
+            module = importlib.import_module(modname)
+            import_times.setdefault(name, time.time() - start)
+    return module
+
+
+def load_for_script(data):
+    """Import the backends used by the nodes of a script, given
+    as its JSON data, so their node types are registered."""
+    nodelist = data.values() if isinstance(data, dict) else data
+    for nodedata in nodelist:
+        if not isinstance(nodedata, dict):
+            continue
+        modname = nodedata.get("type", "").split(".")[0]
+        if modname in BACKENDS:
+            load(modname)
+    return data
+
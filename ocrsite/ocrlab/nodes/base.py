@@ -9,12 +9,13 @@ import codecs
 import json
 import subprocess as sp
 import inspect
+import threading
 
 from nodetree import node, writable_node, exceptions
-import ocrolib
+import numpy
 from PIL import Image
 
-from .. import stages, types, utils
+from .. import imageops, stages, types, utils
 
 
 class ExternalToolError(StandardError):
@@ -52,6 +53,20 @@ class JSONWriterMixin(writable_node.WritableNodeMixin):
         json.dump(data, handle, ensure_ascii=False)
 
 
+class SegmentationWriterMixin(writable_node.WritableNodeMixin):
+    """Functions for reading and writing a page segmentation as
+    compressed numpy arrays."""
+    extension = ".npz"
+
+    @classmethod
+    def reader(cls, handle):
+        return types.Segmentation.load(handle)
+
+    @classmethod
+    def writer(cls, handle, data):
+        types.Segmentation(data).save(handle)
+
+
 class PngWriterMixin(writable_node.WritableNodeMixin):
     """Object which writes/reads a PNG."""
     extension = ".png"
@@ -61,11 +76,11 @@ class BinaryPngWriterMixin(PngWriterMixin):
     """Functions for reading and writing a node's data in binary PNG."""
     @classmethod
     def reader(cls, handle):
-        return ocrolib.numpy.asarray(Image.open(handle))
+        return numpy.asarray(Image.open(handle))
 
     @classmethod
     def writer(cls, handle, data):
-        pil = Image.fromarray(data)
+        pil = Image.fromarray(numpy.asarray(data))
         pil.save(handle, "PNG")
 
 
@@ -76,6 +91,29 @@ class GrayPngWriterMixin(BinaryPngWriterMixin):
 
 class RecognizerNode(node.Node):
     """Base class for recognizer nodes."""
+    # Optional callable which is passed each line (a dict of
+    # index, bbox and text) as soon as it has been recognized.
+    result_func = None
+    # Whether get_transcript needs a C-contiguous image rather than
+    # a view onto the page.
+    contiguous_lines = False
+
+    def get_subimages(self, binary, coords, recycle=True):
+        """Generate the subimages of the binary for an array of
+        boxes.  These are views onto the page, or copies if the
+        engine needs contiguous memory.  Unless recycle is False
+        the copies share a buffer, so each is only valid until
+        the next one is generated."""
+        pool = utils.BufferPool() if recycle else None
+        for x0, y0, x1, y1 in coords:
+            image = binary[y0:y1, x0:x1]
+            if not self.contiguous_lines:
+                yield image
+            elif pool is not None:
+                yield pool.copy(image)
+            else:
+                yield numpy.ascontiguousarray(image)
+
     @classmethod
     def get_helper_dir(cls, category):
         """Get the directory containing helper files."""
@@ -95,7 +133,7 @@ class LineRecognizerNode(RecognizerNode, TextWriterMixin):
     """Node which takes a binary and a segmentation and
     recognises text one line at a time."""
     stage = stages.RECOGNIZE
-    intypes = [ocrolib.numpy.ndarray, dict]
+    intypes = [numpy.ndarray, types.Segmentation]
     outtype = types.HocrString
     abstract = True
 
@@ -119,22 +157,21 @@ class LineRecognizerNode(RecognizerNode, TextWriterMixin):
         """
         self.prepare()
         pageheight, pagewidth = binary.shape
-        iulibbin = ocrolib.numpy2narray(binary)
+        coords = utils.get_boxes(boxes, "lines")
+        clipped = utils.clip_boxes(coords, pagewidth, pageheight)
         out = dict(bbox=[0, 0, pagewidth, pageheight], lines=[])
-        numlines = len(boxes.get("lines", []))
-        for i in range(numlines):
+        numlines = len(coords)
+        lineimages = self.get_subimages(binary, clipped)
+        for i, lineimage in enumerate(lineimages):
             set_progress(self.logger, self.progress_func, i, numlines)
-            coords = boxes.get("lines")[i]
-            iulibcoords = (
-                    coords[0], pageheight - coords[3], coords[2],
-                    pageheight - coords[1])
-            lineimage = ocrolib.iulib.bytearray()
-            ocrolib.iulib.extract_subimage(lineimage, iulibbin, *iulibcoords)
-            out["lines"].append(dict(
+            line = dict(
                     index=i+1,
-                    bbox=[coords[0], coords[1], coords[2], coords[3]],
-                    text=self.get_transcript(ocrolib.narray2numpy(lineimage)),
-            ))
+                    bbox=coords[i].tolist(),
+                    text=self.get_transcript(lineimage),
+            )
+            out["lines"].append(line)
+            if self.result_func is not None:
+                self.result_func(line)
         set_progress(self.logger, self.progress_func, numlines, numlines)
         self.cleanup()
         return utils.hocr_from_data(out)
@@ -144,9 +181,12 @@ class ColumnRecognizerNode(RecognizerNode, TextWriterMixin):
     """Node which takes a binary and a segmentation and
     recognises each column separately."""
     stage = stages.RECOGNIZE
-    intypes = [ocrolib.numpy.ndarray, dict]
+    intypes = [numpy.ndarray, types.Segmentation]
     outtype = types.HocrString
     abstract = True
+    # Number of columns to recognise concurrently, or
+    # None for one per CPU.
+    max_workers = None
 
     def init_converter(self):
         raise NotImplementedError
@@ -168,21 +208,22 @@ class ColumnRecognizerNode(RecognizerNode, TextWriterMixin):
         """
         self.prepare()
         pageheight, pagewidth = binary.shape
-        iulibbin = ocrolib.numpy2narray(binary)
-        out = [] # list of hocr strings
-        numcols = len(boxes.get("columns", []))
-        for i in range(numcols):
-            set_progress(self.logger, self.progress_func, i, numcols)
-            coords = boxes.get("columns")[i]
-            iulibcoords = (
-                    coords[0], pageheight - coords[3], coords[2],
-                    pageheight - coords[1])
-            colimage = ocrolib.iulib.bytearray()
-            ocrolib.iulib.extract_subimage(colimage, iulibbin, *iulibcoords)
-            out.append(self.get_transcript(ocrolib.narray2numpy(colimage)))
-        set_progress(self.logger, self.progress_func, numcols, numcols)
+        coords = utils.clip_boxes(utils.get_boxes(boxes, "columns"),
+                pagewidth, pageheight)
+        numcols = len(coords)
+        colimages = self.get_subimages(binary, coords, recycle=False)
+        lock = threading.Lock()
+        done = [0]
+        def recognize(colimage):
+            hocr = self.get_transcript(colimage)
+            with lock:
+                done[0] += 1
+                set_progress(self.logger, self.progress_func, done[0], numcols)
+            return hocr
+        out = utils.parallel_map(recognize, colimages, self.max_workers)
         self.cleanup()
-        return utils.merge_hocr(out)
+        return utils.merge_hocr(out, offsets=coords[:, :2].tolist(),
+                bbox=[0, 0, pagewidth, pageheight])
 
 
 def set_progress(logger, progress_func, step, end, granularity=5):
@@ -214,11 +255,13 @@ class CommandLineRecognizerNode(LineRecognizerNode):
     @classmethod
     def write_binary(cls, path, data):
         """Write a binary image."""
+        import ocrolib
         ocrolib.iulib.write_image_binary(path.encode(), ocrolib.numpy2narray(data))
 
     @classmethod
     def write_packed(cls, path, data):
         """Write a packed image."""
+        import ocrolib
         ocrolib.iulib.write_image_packed(path.encode(), ocrolib.pseg2narray(data))
 
     @utils.check_aborted
@@ -266,7 +309,68 @@ class ImageGeneratorNode(node.Node):
 
     def null_data(self):
         """Return an empty numpy image."""
-        return ocrolib.numpy.zeros((640,480,3), dtype=ocrolib.numpy.uint8)
+        return numpy.zeros((640,480,3), dtype=numpy.uint8)
+
+
+class ImageDecoderNode(ImageGeneratorNode):
+    """Node which reads an image file.  The optimize pass can give
+    it the transform nodes (see ImageOpNode) it feeds, whose ops it
+    then does as it decodes, so only the pixels they need are."""
+    abstract = True
+    decoded_for = ()
+
+    def decode_for(self, nodes):
+        self.decoded_for = tuple(nodes)
+
+    def get_decode_ops(self):
+        ops = []
+        for n in self.decoded_for:
+            ops.extend(m.image_op() for m in n.fused)
+            ops.append(n.image_op())
+        return ops
+
+    def hash_value(self):
+        """Include the ops, since they change our output."""
+        value = super(ImageDecoderNode, self).hash_value()
+        if not self.decoded_for:
+            return value
+        return dict(node=value, ops=repr(self.get_decode_ops()))
+
+
+class ImageOpNode(node.Node):
+    """Node which does a simple image transform, described by
+    image_op() (see imageops.py).  The optimize pass can fuse a run
+    of these into the last of them, which then does the ops of the
+    nodes it replaced too."""
+    abstract = True
+    # nodes whose ops run before this one's, in order
+    fused = ()
+    # whether our input node does our ops as it decodes
+    in_input = False
+
+    def image_op(self):
+        """Get the op tuple for this node's transform."""
+        raise NotImplementedError
+
+    def fuse(self, nodes, input):
+        """Take over the ops of the given nodes, which
+        previously fed this one, and read from their input."""
+        self.fused = tuple(nodes)
+        self.set_input(0, input)
+
+    def hash_value(self):
+        """Include the fused nodes, since they no
+        longer appear among our inputs."""
+        value = super(ImageOpNode, self).hash_value()
+        if not self.fused:
+            return value
+        return dict(node=value, fused=self.fused[-1].hash_value())
+
+    def process(self, image):
+        if self.in_input:
+            return image
+        ops = [n.image_op() for n in self.fused]
+        return imageops.run(image, ops + [self.image_op()])
 
 
 class FileNode(node.Node):
@@ -278,7 +382,7 @@ class FileNode(node.Node):
         if self._params.get("path") is None:
             raise exceptions.ValidationError("'path' not set", self)
         path = self._params.get("path", "")
-        if isinstance(path, basestring) and not os.path.exists(path):
+        if imageops.is_missing(path):
             raise exceptions.ValidationError("'path': file not found", self)
 
 
@@ -1,13 +1,13 @@
 
 from __future__ import absolute_import
 
-from nodetree import node, writable_node, exceptions
-from .base import GrayPngWriterMixin
-from .. import stages
+from nodetree import writable_node, exceptions
+from .base import GrayPngWriterMixin, ImageOpNode
+from .. import imageops, stages
 import numpy
 
 
-class Rotate90(node.Node, GrayPngWriterMixin):
+class Rotate90(ImageOpNode, GrayPngWriterMixin):
     """Rotate a Numpy image num*90 degrees counter-clockwise."""
     stage = stages.FILTER_BINARY
     intypes = [numpy.ndarray]
@@ -26,8 +26,8 @@ class Rotate90(node.Node, GrayPngWriterMixin):
         except ValueError:
             raise exceptions.ValidationError("'num' must be an integer", self)
 
-    def process(self, image):
-        return numpy.rot90(image, int(self._params.get("num", 1)))
+    def image_op(self):
+        return imageops.rotate(self._params.get("num", 1))
 
 
 class Rotate90Gray(Rotate90):
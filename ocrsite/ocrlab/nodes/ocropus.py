@@ -3,6 +3,9 @@
 import os
 import sys
 import json
+import hashlib
+import tempfile
+import threading
 
 from nodetree import node, writable_node, exceptions
 from nodetree import utils as nodeutils
@@ -10,7 +13,25 @@ from nodetree import utils as nodeutils
 import ocrolib
 
 from . import base
-from .. import stages, utils
+from .. import imageops, stages, tiling, types, utils
+from ..modelregistry import registry
+
+
+# Where the names and parameters of the installed Ocropus
+# components are cached between processes.
+COMPONENT_CACHE_DIR = os.environ.get("OCRLAB_COMPONENT_CACHE",
+        tempfile.gettempdir())
+
+# Components which only look at a small window around each pixel,
+# and so give the same result run on overlapping tiles of a page.
+# Global ones (Otsu, deskewing, etc.) don't, so can't be tiled.
+TILEABLE_COMPONENTS = ("BinarizeBySauvola",)
+
+TILE_PARAMETERS = [
+    dict(name="tile_size", value=0),
+    dict(name="tile_halo", value=tiling.DEFAULT_HALO),
+    dict(name="tile_workers", value=1),
+]
 
 class UnknownOcropusNodeType(Exception):
     pass
@@ -30,20 +51,146 @@ def makesafe(val):
     return val
 
 
-class GrayFileIn(base.ImageGeneratorNode,
+def get_parameters(comp):
+    """Get the default parameters of a native component."""
+    def makesafe(v):
+        if v is None:
+            return 0
+        return v
+    p = []
+    for i in range(comp.plength()):
+        n = comp.pname(i)
+        p.append(dict(
+            name=n,
+            value=makesafe(comp.pget(n)),
+        ))
+    return p
+
+
+def clone_component(comp):
+    """Make a new native component of the same type and with the
+    same parameters as comp."""
+    clone = comp.__class__()
+    for i in range(comp.plength()):
+        name = comp.pname(i)
+        clone.pset(name, comp.pget(name))
+    return clone
+
+
+class LazyComponent(object):
+    """Class attribute which creates a native component the first
+    time it's accessed, so only the components a script actually
+    uses get instantiated."""
+    def __init__(self, name):
+        self.name = name
+        self.comp = None
+        self._lock = threading.Lock()
+
+    def __get__(self, obj, cls):
+        if self.comp is None:
+            with self._lock:
+                if self.comp is None:
+                    self.comp = getattr(ocrolib, makesafe(self.name))()
+        return self.comp
+
+
+class NativeImage(object):
+    """An image passed between consecutive Ocropus nodes as an iulib
+    bytearray, so the page isn't converted to numpy and back at every
+    step.  It's only converted, once, when something other than an
+    Ocropus component (i.e. a cache writer) asks for an array, or
+    uses it like one."""
+    # so numpy defers to our operators, which convert
+    __array_priority__ = 10.0
+
+    def __init__(self, narray):
+        self.narray = narray
+        self._array = None
+
+    @property
+    def shape(self):
+        # narrays are indexed (x, y)
+        return (self.narray.dim(1), self.narray.dim(0))
+
+    def numpy(self):
+        """Get the image as a numpy array."""
+        if self._array is None:
+            self._array = ocrolib.narray2numpy(self.narray)
+        return self._array
+
+    def __array__(self, dtype=None):
+        if dtype is None:
+            return self.numpy()
+        return self.numpy().astype(dtype)
+
+    def __getitem__(self, index):
+        return self.numpy()[index]
+
+    def __getattr__(self, name):
+        return getattr(self.numpy(), name)
+
+
+def _forward_to_numpy(name):
+    def method(self, *args):
+        return getattr(self.numpy(), name)(*args)
+    method.__name__ = name
+    return method
+
+# special methods are looked up on the class, not via __getattr__
+for _name in ("__len__", "__iter__", "__nonzero__", "__eq__", "__ne__",
+        "__lt__", "__le__", "__gt__", "__ge__", "__neg__", "__invert__",
+        "__add__", "__radd__", "__sub__", "__rsub__", "__mul__",
+        "__rmul__", "__div__", "__rdiv__", "__truediv__", "__rtruediv__",
+        "__floordiv__", "__rfloordiv__", "__and__", "__rand__",
+        "__or__", "__ror__", "__xor__", "__rxor__"):
+    setattr(NativeImage, _name, _forward_to_numpy(_name))
+
+
+def get_narray(image):
+    """Get an image as an iulib bytearray, only converting
+    it if it isn't a NativeImage."""
+    if isinstance(image, NativeImage):
+        return image.narray
+    return ocrolib.numpy2narray(image, "B")
+
+
+def load_character_model(path):
+    """Load a native Ocropus character model."""
+    linerec = ocrolib.RecognizeLine()
+    linerec.load_native(makesafe(path))
+    return linerec
+
+
+def load_language_model(path):
+    """Load an OcroFST language model."""
+    lmodel = ocrolib.OcroFST()
+    lmodel.load(makesafe(path))
+    return lmodel
+
+
+class GrayFileIn(base.ImageDecoderNode,
             base.FileNode, base.GrayPngWriterMixin):
-    """A node that takes a file and returns a numpy object."""
+    """A node that takes a file and returns a numpy object.  The
+    path can also be a file object or the file's data, as a string
+    or buffer, which is decoded in memory with PIL.  Files are also
+    decoded with PIL when the optimize pass gives us the transforms
+    we feed, in which case color images are converted to gray with
+    PIL's weighting of the channels rather than Ocropus's, so gray
+    values may differ slightly from those of an unfused script."""
     stage = stages.INPUT
     intypes = []
     outtype = ocrolib.numpy.ndarray
     parameters = [dict(name="path", value="", type="filepath")]
 
     def process(self):
-        # TODO: Ensure we can also read a filehandle
-        if not os.path.exists(self._params.get("path", "")):
+        source = imageops.get_source(self._params.get("path", ""))
+        if imageops.is_missing(source):
             return self.null_data()
-        return ocrolib.read_image_gray(makesafe(self._params.get("path")))
-        
+        if self.decoded_for or not imageops.is_path(source):
+            return imageops.decode(source, self.get_decode_ops(),
+                    as_gray=True)
+        return ocrolib.read_image_gray(makesafe(source))
+
 
 class Crop(node.Node, base.BinaryPngWriterMixin):
     """Crop a PNG input."""
@@ -58,11 +205,11 @@ class Crop(node.Node, base.BinaryPngWriterMixin):
     ]
 
     def process(self, input):
-        """Crop an image, using IULIB.  If any of
-        the parameters are -1 or less, use the
+        """Crop an image, returning a view of the input.
+        If any of the parameters are -1 or less, use the
         outer dimensions."""
         x0, y0 = 0, 0
-        y1, x1 = input.shape
+        y1, x1 = input.shape[:2]
         try:
             x0 = int(self._params.get("x0", -1))
             if x0 < 0: x0 = 0
@@ -79,19 +226,18 @@ class Crop(node.Node, base.BinaryPngWriterMixin):
             y1 = int(self._params.get("y1", -1))
             if y1 < 0: y1 = input.shape[0]
         except TypeError: pass
-        # flip the coord system from HOCR to internal
-        iy0 = input.shape[1] - y1
-        iy1 = input.shape[1] - y0i
-        iulibbin = ocrolib.numpy2narray(input)
-        out = ocrolib.iulib.bytearray()
-        ocrolib.iulib.extract_subimage(out, iulibbin, x0, iy0, x1, iy1)
-        return ocrolib.narray2numpy(out)
+        # HOCR coords are top-origin, like numpy's
+        return input[y0:y1, x0:x1]
 
 
 class OcropusBase(node.Node):
     """Wrapper around Ocropus component interface."""
     abstract = True
     _comp = None
+    # cached default parameters of the component
+    _schema = None
+    # parameters of the node itself, rather than the component
+    extra_parameters = []
 
     def __init__(self, **kwargs):
         """Initialise with the ocropus component."""
@@ -99,6 +245,8 @@ class OcropusBase(node.Node):
 
     def _set_p(self, p, v):
         """Set a component param."""
+        if p in [e["name"] for e in self.extra_parameters]:
+            return
         self._comp.pset(makesafe(p), makesafe(v))
 
     def __getstate__(self):
@@ -118,29 +266,86 @@ class OcropusBase(node.Node):
     @nodeutils.ClassProperty
     @classmethod
     def parameters(cls):
-        """Get parameters from an Ocropus Node."""
-        def makesafe(v):
-            if v is None:
-                return 0
-            return v
-        p = []
-        for i in range(cls._comp.plength()):
-            n = cls._comp.pname(i)
-            p.append(dict(
-                name=n,
-                value=makesafe(cls._comp.pget(n)),
-            ))
-        return p
-
-
-class OcropusBinarizeBase(OcropusBase, base.BinaryPngWriterMixin):
-    """Binarize an image with an Ocropus component."""
+        """Get parameters from an Ocropus Node, without
+        creating the component if they're already known."""
+        if cls._schema is not None:
+            params = [dict(p) for p in cls._schema]
+        else:
+            params = get_parameters(cls._comp)
+        return params + [dict(p) for p in cls.extra_parameters]
+
+
+class OcropusImageFilterBase(OcropusBase):
+    """Ocropus component which turns an image into another of
+    the same size.  If the component is tileable and the tile_size
+    parameter is set, very large pages are processed as overlapping
+    tiles of that size with tile_halo pixels of context, up to
+    tile_workers at a time (each with its own copy of the
+    component), to bound memory use.  When native_output is set
+    (see optimize.py) the result is returned as a NativeImage for
+    the next Ocropus node."""
     abstract = True
-    stage = stages.BINARIZE
+    native_input = True
+    native_output = False
     intypes = [ocrolib.numpy.ndarray]
     outtype = ocrolib.numpy.ndarray
+    tileable = False
+
+    def apply(self, comp, input):
+        """Run the given component on an image."""
+        raise NotImplementedError
+
+    def apply_native(self, native, out, input):
+        """Run the given native component on an input bytearray,
+        filling the out bytearray."""
+        raise NotImplementedError
+
+    def process_native(self, input):
+        """Run the component directly on bytearrays.  Returns None
+        if it has no native interface we know how to call."""
+        native = getattr(self._comp, "comp", None)
+        if native is None:
+            return None
+        out = ocrolib.iulib.bytearray()
+        try:
+            self.apply_native(native, out, get_narray(input))
+        except (NotImplementedError, TypeError):
+            # SWIG's complaint about mismatched arguments
+            return None
+        result = NativeImage(out)
+        return result if self.native_output else result.numpy()
 
     def process(self, input):
+        try:
+            size = int(self._params.get("tile_size", 0) or 0) \
+                    if self.tileable else 0
+            if size <= 0:
+                if self.native_output or isinstance(input, NativeImage):
+                    out = self.process_native(input)
+                    if out is not None:
+                        return out
+                return self.apply(self._comp, ocrolib.numpy.asarray(input))
+            input = ocrolib.numpy.asarray(input)
+            halo = int(self._params.get("tile_halo", tiling.DEFAULT_HALO))
+            workers = int(self._params.get("tile_workers", 1))
+            local = threading.local()
+            def apply(tile):
+                # concurrent tiles each need their own component
+                if not hasattr(local, "comp"):
+                    local.comp = self._comp if workers <= 1 \
+                            else clone_component(self._comp)
+                return self.apply(local.comp, tile)
+            return tiling.run_tiled(apply, input, size, halo, workers)
+        except (IndexError, TypeError, ValueError), err:
+            raise OcropusNodeError(err.message, self)
+
+
+class OcropusBinarizeBase(OcropusImageFilterBase, base.BinaryPngWriterMixin):
+    """Binarize an image with an Ocropus component."""
+    abstract = True
+    stage = stages.BINARIZE
+
+    def apply(self, comp, input):
         """Perform binarization on an image.
         
         input: a grayscale image.
@@ -148,23 +353,23 @@ class OcropusBinarizeBase(OcropusBase, base.BinaryPngWriterMixin):
         # NB. The Ocropus binarize function
         # returns a tuple: (binary, gray)
         # we ignore the latter.
-        try:
-            out = self._comp.binarize(input, type="B")[0]
-        except (IndexError, TypeError, ValueError), err:
-            raise OcropusNodeError(err.message, self)
-        return out
+        return comp.binarize(input, type="B")[0]
+
+    def apply_native(self, native, out, input):
+        native.binarize(out, input)
 
 
-class OcropusSegmentPageBase(OcropusBase, base.JSONWriterMixin):
+class OcropusSegmentPageBase(OcropusBase, base.SegmentationWriterMixin):
     """Segment an image using Ocropus."""
     abstract = True
     stage = stages.PAGE_SEGMENT
     intypes = [ocrolib.numpy.ndarray]
-    outtype = dict
+    outtype = types.Segmentation
+    native_input = True
 
     def null_data(self):
-        """Return an empty list when ignored."""
-        return dict(columns=[], lines=[], paragraphs=[])
+        """Return an empty segmentation when ignored."""
+        return types.Segmentation()
 
     def process(self, input):
         """Segment a binary image.
@@ -176,10 +381,10 @@ class OcropusSegmentPageBase(OcropusBase, base.JSONWriterMixin):
             columns
             images
         """
-        out = dict(bbox=[0, 0, input.shape[1], input.shape[0]],
-                columns=[], lines=[], paragraphs=[])
+        out = types.Segmentation(
+                bbox=[0, 0, input.shape[1], input.shape[0]])
         try:
-            page_seg = self._comp.segment(input)
+            page_seg = self.segment(input)
         except (IndexError, TypeError, ValueError), err:
             raise OcropusNodeError(err.message, self)
         regions = ocrolib.RegionExtractor()
@@ -189,45 +394,51 @@ class OcropusSegmentPageBase(OcropusBase, base.JSONWriterMixin):
         # for some reason
         for box, func in exfuncs.iteritems():
             func(page_seg)
-            for i in range(1, regions.length()):
-                out[box].append((
-                    regions.x0(i), regions.y0(i), regions.x1(i), regions.y1(i)))
+            out[box] = utils.get_region_boxes(regions)
         return out
 
+    def segment(self, input):
+        """Get the page segmentation of a binary, going straight
+        to the native component if we were given a NativeImage."""
+        native = getattr(self._comp, "comp", None)
+        if isinstance(input, NativeImage) and native is not None:
+            try:
+                page_seg = ocrolib.iulib.intarray()
+                native.segment(page_seg, input.narray)
+                return ocrolib.narray2pseg(page_seg)
+            except (NotImplementedError, TypeError):
+                pass
+        return self._comp.segment(ocrolib.numpy.asarray(input))
+
 
-class OcropusGrayscaleFilterBase(OcropusBase, base.GrayPngWriterMixin):
+class OcropusGrayscaleFilterBase(OcropusImageFilterBase, base.GrayPngWriterMixin):
     """Filter a binary image."""
     abstract = True
     stage = stages.FILTER_GRAY
-    intypes = [ocrolib.numpy.ndarray]
-    outtype = ocrolib.numpy.ndarray
 
-    def process(self, input):
-        try:
-            out = self._comp.cleanup_gray(input, type="B")
-        except (IndexError, TypeError, ValueError), err:
-            raise OcropusNodeError(err.message, self)
-        return out
+    def apply(self, comp, input):
+        return comp.cleanup_gray(input, type="B")
+
+    def apply_native(self, native, out, input):
+        native.cleanup_gray(out, input)
 
 
 
-class OcropusBinaryFilterBase(OcropusBase, base.BinaryPngWriterMixin):
+class OcropusBinaryFilterBase(OcropusImageFilterBase, base.BinaryPngWriterMixin):
     """Filter a binary image."""
     abstract = True
     stage = stages.FILTER_BINARY
-    intypes = [ocrolib.numpy.ndarray]
-    outtype = ocrolib.numpy.ndarray
 
-    def process(self, input):
-        try:
-            out = self._comp.cleanup(input, type="B")
-        except (IndexError, TypeError, ValueError), err:
-            raise OcropusNodeError(err.message, self)
-        return out
+    def apply(self, comp, input):
+        return comp.cleanup(input, type="B")
+
+    def apply_native(self, native, out, input):
+        native.cleanup(out, input)
 
 
 class OcropusRecognizer(base.LineRecognizerNode):
     """Ocropus Native text recogniser."""
+    contiguous_lines = True
 
     @nodeutils.ClassProperty
     @classmethod
@@ -251,21 +462,38 @@ class OcropusRecognizer(base.LineRecognizerNode):
         if self._params.get("language_model", "").strip() == "":
             raise exceptions.ValidationError("no language model given: %s" % self._params, self)
 
+    @classmethod
+    def get_models(cls, character_model, language_model):
+        """Get the (shared) line-recogniser and lmodel FST objects
+        from the process-wide model registry."""
+        cmodpath = os.path.join(cls.get_helper_dir("char"), character_model)
+        lmodpath = os.path.join(cls.get_helper_dir("lang"), language_model)
+        return (registry.get(cmodpath, load_character_model),
+                registry.get(lmodpath, load_language_model))
+
+    @classmethod
+    def preload(cls, **params):
+        """Load models ahead of time, i.e. in a worker parent process
+        before it forks its children."""
+        defaults = dict((p["name"], p["value"]) for p in cls.parameters)
+        defaults.update(params)
+        cls.get_models(defaults["character_model"],
+                defaults["language_model"])
+
     def init_converter(self):
         """Load the line-recogniser and the lmodel FST objects."""
-        try:
-            self._linerec = ocrolib.RecognizeLine()
-            cmodpath = os.path.join(self.get_helper_dir("char"), 
-                    self._params["character_model"])
-            self.logger.debug("Loading char mod file: %s" % cmodpath)
-            self._linerec.load_native(cmodpath.encode())
-            self._lmodel = ocrolib.OcroFST()
-            lmodpath = os.path.join(self.get_helper_dir("lang"), 
-                    self._params["language_model"])
-            self.logger.debug("Loading lang mod file: %s" % lmodpath)
-            self._lmodel.load(lmodpath.encode())
-        except (StandardError, RuntimeError):
-            raise
+        self.logger.debug("Loading char mod file: %s",
+                self._params["character_model"])
+        self.logger.debug("Loading lang mod file: %s",
+                self._params["language_model"])
+        self._linerec, self._lmodel = self.get_models(
+                self._params["character_model"],
+                self._params["language_model"])
+
+    def prepare(self):
+        """Fetch the models for the current parameters.  This is
+        cheap once they're in the registry."""
+        self.init_converter()
 
     @utils.check_aborted
     def get_transcript(self, line):
@@ -278,6 +506,17 @@ class OcropusRecognizer(base.LineRecognizerNode):
         out, _ = ocrolib.beam_search_simple(fst, self._lmodel, 1000)
         return out
 
+
+def component_cache_path(cachedir=None):
+    """Get the path of the component cache for the installed
+    ocrolib, which changes whenever ocrolib does."""
+    path = os.path.abspath(ocrolib.__file__)
+    key = hashlib.md5("%s:%s:%s" % (getattr(ocrolib, "__version__", ""),
+            path, os.path.getmtime(path))).hexdigest()
+    return os.path.join(cachedir or COMPONENT_CACHE_DIR,
+            "ocrlab-ocropus-%s.json" % key)
+
+
 class Manager(object):
     """Interface to ocropus."""
     _use_types = (
@@ -289,6 +528,8 @@ class Manager(object):
     _ignored = (
         "StandardPreprocessing",
     )
+    _schemas = None
+    _classes = {}
 
     @classmethod
     def get_components(cls, oftypes=None, withnames=None, exclude=None):
@@ -296,7 +537,44 @@ class Manager(object):
         (possibly of a given type) and their default parameters."""
         return cls._get_native_components(oftypes, withnames, exclude=exclude)
     
-    
+    @classmethod
+    def get_schemas(cls, cachedir=None):
+        """Get the name, interface and default parameters of each
+        usable component.  These are read from the disk cache if
+        possible, since getting them means instantiating every
+        component."""
+        if cls._schemas is None:
+            path = component_cache_path(cachedir)
+            try:
+                with open(path, "r") as fh:
+                    cls._schemas = json.load(fh)
+            except (IOError, ValueError):
+                cls._schemas = cls._get_native_schemas()
+                cls._write_schemas(path, cls._schemas)
+        return cls._schemas
+
+    @classmethod
+    def _get_native_schemas(cls):
+        """Enumerate the components and get their schemas."""
+        return [dict(
+                name=comp.__class__.__name__,
+                interface=comp.interface(),
+                parameters=get_parameters(comp),
+            ) for comp in cls.get_components(
+                    oftypes=cls._use_types, exclude=cls._ignored)]
+
+    @classmethod
+    def _write_schemas(cls, path, schemas):
+        """Write the schema cache atomically, so concurrently
+        starting processes don't read a partial file."""
+        try:
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                    delete=False) as tmp:
+                json.dump(schemas, tmp)
+            os.rename(tmp.name, path)
+        except (IOError, OSError):
+            pass
+
     @classmethod
     def get_node(cls, name, **kwargs):
         """Get a node by the given name."""
@@ -304,7 +582,7 @@ class Manager(object):
         return klass(**kwargs)
 
     @classmethod
-    def get_node_class(cls, name, comps=None):
+    def get_node_class(cls, name):
         """Get a node class for the given name."""
         # if we get a qualified name like
         # Ocropus::Recognizer, remove the
@@ -312,44 +590,48 @@ class Manager(object):
         # looking in the right module
         if name.find("::") != -1:
             name = name.split("::")[-1]
-
-        # FIXME: This clearly sucks
-        comp = None
-        if comps is not None:
-            for c in comps:
-                if name == c.__class__.__name__:
-                    comp = c
-                    break
-        else:
-            comp = getattr(ocrolib, name)()
-        if node is None:
+        if name in cls._classes:
+            return cls._classes[name]
+
+        schema = None
+        for s in cls.get_schemas():
+            if s["name"] == name:
+                schema = s
+                break
+        if schema is None:
             raise NoSuchNodeException(name)
 
         base = OcropusBase
-        if comp.interface() == "IBinarize":
+        if schema["interface"] == "IBinarize":
             base = OcropusBinarizeBase
-        elif comp.interface() == "ISegmentPage":
+        elif schema["interface"] == "ISegmentPage":
             base = OcropusSegmentPageBase
-        elif comp.interface() == "ICleanupGray":
+        elif schema["interface"] == "ICleanupGray":
             base = OcropusGrayscaleFilterBase
-        elif comp.interface() == "ICleanupBinary":
+        elif schema["interface"] == "ICleanupBinary":
             base = OcropusBinaryFilterBase
         else:
-            raise UnknownOcropusNodeType("%s: '%s'" % (name, comp.interface()))
+            raise UnknownOcropusNodeType("%s: '%s'" % (name, schema["interface"]))
         # this is a bit weird
         # create a new class with the name '<OcropusComponentName>Node'
-        # and the component as the inner _comp attribute
-        return type("%s" % comp.__class__.__name__, (base,), dict(
-            _comp=comp,
+        # and a descriptor which creates the component as the inner
+        # _comp attribute when it's first used
+        attrs = dict(
+            _comp=LazyComponent(name),
+            _schema=schema["parameters"],
             __module__=__name__
-        ))
+        )
+        if name in TILEABLE_COMPONENTS:
+            attrs.update(tileable=True, extra_parameters=TILE_PARAMETERS)
+        klass = type(makesafe(name), (base,), attrs)
+        cls._classes[name] = klass
+        return klass
 
     @classmethod
     def get_nodes(cls, *oftypes, **kwargs):
         """Get nodes of the given type."""
-        rawcomps = cls.get_components(oftypes=cls._use_types, exclude=cls._ignored)
-        return [cls.get_node_class(comp.__class__.__name__, comps=rawcomps) \
-                for comp in rawcomps]
+        return [cls.get_node_class(schema["name"]) \
+                for schema in cls.get_schemas()]
 
 
 
@@ -383,7 +665,8 @@ class Manager(object):
         return out
 
 
-# dynamically generate new nodes classes
+# dynamically generate new nodes classes; their components
+# aren't created until they're used
 Manager.get_nodes()
 
 
@@ -4,17 +4,17 @@ Image transformation nodes based on the Python Image Library (PIL).
 
 from __future__ import absolute_import
 
-import os
 from nodetree import node, exceptions
 import numpy
 from PIL import Image
 
 from . import base
-from .. import stages
+from .. import imageops, stages
 
 
-class RGBFileIn(base.ImageGeneratorNode, base.BinaryPngWriterMixin):
-    """Read a file with PIL."""
+class RGBFileIn(base.ImageDecoderNode, base.BinaryPngWriterMixin):
+    """Read a file with PIL.  The path can also be a file
+    object or the file's data, as a string or buffer."""
     stage = stages.INPUT
     intypes = []
     outtype = numpy.ndarray
@@ -25,12 +25,10 @@ class RGBFileIn(base.ImageGeneratorNode, base.BinaryPngWriterMixin):
 
     def process(self):
         path = self._params.get("path")
-        if isinstance(path, basestring) and not os.path.exists(path):
+        if imageops.is_missing(path):
             return self.null_data()
-        pil = Image.open(path)
-        if self._params.get("convert_to_gray", True):
-            pil = pil.convert("L")
-        return numpy.asarray(pil)
+        return imageops.decode(path, self.get_decode_ops(),
+                as_gray=self._params.get("convert_to_gray", True))
 
     @classmethod
     def reader(cls, handle):
@@ -42,7 +40,42 @@ class RGBFileIn(base.ImageGeneratorNode, base.BinaryPngWriterMixin):
         pil.save(handle, "PNG")
 
 
-class PilScale(node.Node, base.BinaryPngWriterMixin):
+class MultiPageFileIn(RGBFileIn):
+    """Read one page of a multi-page file (i.e. a TIFF) with PIL,
+    without decoding the others.  Pages are numbered from 0.  Tasks
+    run scripts starting with this node once for each page."""
+    parameters = RGBFileIn.parameters + [
+            dict(name="page", value=0),
+    ]
+
+    def validate(self):
+        super(MultiPageFileIn, self).validate()
+        try:
+            int(self._params.get("page", 0))
+        except (TypeError, ValueError):
+            raise exceptions.ValidationError("'page' must be an integer", self)
+
+    def page_count(self):
+        """Get the number of pages in the file."""
+        path = self._params.get("path")
+        if imageops.is_missing(path):
+            return 0
+        return imageops.count_pages(path)
+
+    def process(self):
+        path = self._params.get("path")
+        if imageops.is_missing(path):
+            return self.null_data()
+        page = int(self._params.get("page", 0))
+        try:
+            return imageops.decode(path, self.get_decode_ops(),
+                    as_gray=self._params.get("convert_to_gray", True),
+                    page=page)
+        except EOFError:
+            raise exceptions.NodeError("No page %d in file" % page, self)
+
+
+class PilScale(base.ImageOpNode, base.BinaryPngWriterMixin):
     """Scale an image with PIL"""
     stage = stages.FILTER_GRAY
     intypes = [numpy.ndarray]
@@ -63,16 +96,13 @@ class PilScale(node.Node, base.BinaryPngWriterMixin):
         except ValueError:
             raise exceptions.ValidationError("'float' must be a float", self)
     
-    def process(self, image):
-        """Scale image."""
-        scale = float(self._params.get("scale"))
-        pil = Image.fromarray(image)
-        dims = [int(dim * scale) for dim in pil.size]
-        scaled = pil.resize(tuple(dims), getattr(Image, self._params.get("filter")))
-        return numpy.asarray(scaled.convert("L"))
+    def image_op(self):
+        """Scale image, converting it to grayscale."""
+        return imageops.scale(self._params.get("scale"),
+                self._params.get("filter", "NEAREST"))
 
 
-class PilCrop(node.Node, base.BinaryPngWriterMixin):
+class PilCrop(base.ImageOpNode, base.BinaryPngWriterMixin):
     """Crop an image with PIL."""
     stage = stages.FILTER_GRAY
     intypes = [numpy.ndarray]
@@ -84,46 +114,23 @@ class PilCrop(node.Node, base.BinaryPngWriterMixin):
         dict(name="y1", value=-1),
     ]
 
-    def process(self, input):
-        """Crop an image, using IULIB.  If any of
-        the parameters are -1 or less, use the
-        outer dimensions."""
-        x0, y0 = 0, 0
-        y1, x1 = input.shape
-        try:
-            x0 = int(self._params.get("x0", -1))
-            if x0 < 0: x0 = 0
-        except TypeError: pass
-        try:
-            y0 = int(self._params.get("y0", -1))
-            if y0 < 0: y0 = 0
-        except TypeError: pass
-        try:
-            x1 = int(self._params.get("x1", -1))
-            if x1 < 0: x1 = input.shape[1]
-        except TypeError: pass
-        try:
-            y1 = int(self._params.get("y1", -1))
-            if y1 < 0: y1 = input.shape[0]
-        except TypeError: pass
-        pil = Image.fromarray(input)
-        p2 = pil.crop((x0, y0, x1, y1))
-        self.logger.debug("Pil crop: %s", p2)
-        n = numpy.asarray(p2.convert("L"))
-        self.logger.debug("Numpy: %s", n)
-        return n
-
-
-class RGB2Gray(node.Node, base.GrayPngWriterMixin):
+    def image_op(self):
+        """Crop an image, returning a view of the input
+        if it's already grayscale.  If any of the parameters
+        are -1 or less, use the outer dimensions."""
+        return imageops.crop(*[self._params.get(p, -1)
+                for p in ("x0", "y0", "x1", "y1")])
+
+
+class RGB2Gray(base.ImageOpNode, base.GrayPngWriterMixin):
     """Convert (roughly) between a color image and BW."""
     stage = stages.FILTER_GRAY
     intypes = [numpy.ndarray]
     outtype = numpy.ndarray
     parameters = []
 
-    def process(self, image):
-        pil = Image.fromarray(image)
-        return numpy.asarray(pil.convert("L"))
+    def image_op(self):
+        return imageops.gray()
 
 
 class PilTest(node.Node):
@@ -7,7 +7,10 @@ from __future__ import absolute_import
 import os
 import shutil
 import codecs
+import hashlib
+import tarfile
 import tempfile
+import threading
 import subprocess as sp
 
 from nodetree import node, exceptions, utils as nodeutils
@@ -20,6 +23,75 @@ from .. import stages, utils, exceptions
 from ocrolib import numpy
 
 
+# Root directory under which unpacked language models are shared
+# between all the workers on a host.
+TESSDATA_CACHE_DIR = os.environ.get("OCRLAB_TESSDATA_CACHE",
+        os.path.join(tempfile.gettempdir(), "ocrlab-tessdata"))
+
+_tessdata = {}
+_tessdata_lock = threading.Lock()
+
+
+def tessdata_key(lmodelpath):
+    """Key identifying a particular version of a language model
+    archive, derived from its path, size and mtime."""
+    stat = os.stat(lmodelpath)
+    return hashlib.md5("%s:%d:%d" % (
+            os.path.abspath(lmodelpath), stat.st_size,
+            int(stat.st_mtime))).hexdigest()
+
+
+def get_tessdata(lmodelpath, cachedir=None):
+    """Get a (prefix, lang) tuple for an unpacked copy of the given
+    tar-gzipped Tesseract language files.  The archive is unpacked at
+    most once per host into a read-only directory that is shared by
+    every worker and node; the prefix is suitable for passing as
+    the TESSDATA_PREFIX of a Tesseract process."""
+    key = tessdata_key(lmodelpath)
+    with _tessdata_lock:
+        if key not in _tessdata:
+            _tessdata[key] = unpack_tessdata(lmodelpath,
+                    os.path.join(cachedir or TESSDATA_CACHE_DIR, key))
+        return _tessdata[key]
+
+
+def unpack_tessdata(lmodelpath, prefix):
+    """Unpack a language model archive into prefix, unless another
+    process has already done so.  The archive is extracted into a
+    private temporary directory which is then renamed into place,
+    so concurrent workers never see a partially-unpacked model.
+    NB: The prefix DOESN'T include the "tessdata" part."""
+    langfile = os.path.join(prefix, "lang")
+    if not os.path.exists(langfile):
+        parent = os.path.dirname(prefix)
+        if not os.path.exists(parent):
+            try:
+                os.makedirs(parent, 0777)
+            except OSError:
+                if not os.path.isdir(parent):
+                    raise
+        tmpdir = tempfile.mkdtemp(dir=parent)
+        datapath = os.path.join(tmpdir, "tessdata")
+        os.mkdir(datapath)
+        # let this throw an exception if it fails.
+        tgz = tarfile.open(lmodelpath, "r:*")
+        lang = os.path.splitext(tgz.getnames()[0])[0]
+        tgz.extractall(path=datapath)
+        tgz.close()
+        for path, dirs, files in os.walk(datapath):
+            for fname in files:
+                os.chmod(os.path.join(path, fname), 0444)
+        with open(os.path.join(tmpdir, "lang"), "w") as fh:
+            fh.write(lang)
+        try:
+            os.rename(tmpdir, prefix)
+        except OSError:
+            # somebody else got there first
+            shutil.rmtree(tmpdir, True)
+    with open(langfile, "r") as fh:
+        return prefix + "/", fh.read().strip()
+
+
 class TesseractRecognizer(base.CommandLineRecognizerNode):
     """Recognize an image using Tesseract."""
     stage = stages.RECOGNIZE
@@ -42,15 +114,23 @@ class TesseractRecognizer(base.CommandLineRecognizerNode):
             raise exceptions.ValidationError("no language model given: %s" % self._params, self)
 
     def prepare(self):
-        """Extract the lmodel to a temporary directory.  This is
-        cleaned up in the destructor."""
-        if not hasattr(self, "_tessdata") is None:
-            modpath = os.path.join(self.get_helper_dir("lang"), 
-                    self._params["language_model"])
-            self.unpack_tessdata(modpath)
+        """Locate the shared, unpacked copy of the selected lmodel."""
+        modpath = os.path.join(self.get_helper_dir("lang"), 
+                self._params["language_model"])
+        self._tessdata, self._lang = get_tessdata(modpath)
+        self.logger.debug("Using tessdata: %s" % self._tessdata)
         self._tesseract = utils.get_binary("tesseract")
         self.logger.debug("Using Tesseract: %s" % self._tesseract)
 
+    def get_environ(self):
+        """Environment for a Tesseract process.  The tessdata dir
+        is passed per-invocation rather than by modifying our own
+        environment, so nodes using different languages can run
+        concurrently."""
+        env = os.environ.copy()
+        env["TESSDATA_PREFIX"] = self._tessdata
+        return env
+
     @utils.check_aborted
     def get_transcript(self, line):
         """Recognise each individual line by writing it as a temporary
@@ -66,26 +146,6 @@ class TesseractRecognizer(base.CommandLineRecognizerNode):
             os.unlink(tiff)
             return text
 
-    def unpack_tessdata(self, lmodelpath):
-        """Unpack the tar-gzipped Tesseract language files into
-        a temporary directory and set TESSDATA_PREFIX environ
-        var to point at it."""
-        # might as well make this even less efficient!
-        self.logger.debug("Unpacking tessdata: %s" % lmodelpath)
-        import tarfile
-        self._tessdata = tempfile.mkdtemp() + "/"
-        datapath = os.path.join(self._tessdata, "tessdata")
-        os.mkdir(datapath)
-        # let this throw an exception if it fails.
-        tgz = tarfile.open(lmodelpath, "r:*")
-        self._lang = os.path.splitext(tgz.getnames()[0])[0]
-        tgz.extractall(path=datapath)
-        tgz.close()
-
-        # set environ var where tesseract picks up the tessdata dir
-        # this DOESN'T include the "tessdata" part
-        os.environ["TESSDATA_PREFIX"] = self._tessdata
-
     @utils.check_aborted
     def process_line(self, imagepath):
         """Run Tesseract on the TIFF image, using YET ANOTHER temporary
@@ -93,8 +153,8 @@ class TesseractRecognizer(base.CommandLineRecognizerNode):
         you think this seems horribly inefficient you'd be right, but
         Tesseract's external interface is quite inflexible.
         TODO: Fix hardcoded path to Tesseract."""
-        if not hasattr(self, "_tessdata"):
-            self.init_converter()
+        if getattr(self, "_tessdata", None) is None:
+            self.prepare()
 
         lines = []
         with tempfile.NamedTemporaryFile() as tmp:
@@ -103,7 +163,8 @@ class TesseractRecognizer(base.CommandLineRecognizerNode):
             tessargs = [self._tesseract, imagepath, tmp.name, "-psm", "7"]
             if self._lang is not None:
                 tessargs.extend(["-l", self._lang])
-            proc = sp.Popen(tessargs, stderr=sp.PIPE)
+            proc = sp.Popen(tessargs, stderr=sp.PIPE,
+                    env=self.get_environ())
             err = proc.stderr.read()
             if proc.wait() != 0:
                 return "!!! TESSERACT CONVERSION ERROR %d: %s !!!" % (proc.returncode, err)
@@ -116,17 +177,6 @@ class TesseractRecognizer(base.CommandLineRecognizerNode):
                 os.unlink(txt.name)
         return " ".join(lines)
 
-    def cleanup(self):
-        """Cleanup temporarily-extracted lmodel directory."""
-        if hasattr(self, "_tessdata") and os.path.exists(self._tessdata):
-            try:
-                self.logger.debug(
-                    "Cleaning up temp tessdata folder: %s" % self._tessdata)
-                shutil.rmtree(self._tessdata)
-            except OSError, (errno, strerr):
-                self.logger.error(
-                    "RmTree raised error: %s, %s" % (errno, strerr))
-
 
 class TesseractPageSeg(TesseractRecognizer):
     """Recognize an image using Tesseract, including segmentation."""
@@ -153,7 +203,7 @@ class TesseractPageSeg(TesseractRecognizer):
         self._configtmp = configtmp.name
 
     def cleanup(self):
-        super(TesseractPageSeg, self).prepare()
+        super(TesseractPageSeg, self).cleanup()
         os.unlink(self._configtmp)
 
     def process(self, binary):
@@ -168,7 +218,8 @@ class TesseractPageSeg(TesseractRecognizer):
                 self.write_binary(btmp.name, binary)
                 args = self.get_command(tmp.name, btmp.name)
                 self.logger.debug("Running: '%s'", " ".join(args))
-                proc = sp.Popen(args, stderr=sp.PIPE)
+                proc = sp.Popen(args, stderr=sp.PIPE,
+                        env=self.get_environ())
                 err = proc.stderr.read()
                 if proc.wait() != 0:
                     print err
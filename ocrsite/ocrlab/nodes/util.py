@@ -9,7 +9,6 @@ import re
 import codecs
 import tempfile
 import subprocess as sp
-from BeautifulSoup import BeautifulSoup, BeautifulStoneSoup
 from nodetree import node, writable_node, exceptions
 
 from . import base
@@ -93,6 +92,8 @@ class HocrToText(node.Node, base.TextWriterMixin):
     parameters = []
 
     def process(self, input):
+        # imported here so the core nodes don't need BeautifulSoup
+        from BeautifulSoup import BeautifulSoup, BeautifulStoneSoup
         soup = BeautifulSoup(input)
         raw = ''.join(soup.find("div", {"class":"ocr_page"}).findAll(text=True))
         decode = BeautifulStoneSoup(raw, 
@@ -0,0 +1,88 @@
+"""
+Passes over a built script, run before it's evaluated, which
+change how its nodes hand data to each other without changing
+what they compute.
+"""
+
+
+def get_graph(tree):
+    """Get the nodes the script's terminals depend on, and the
+    nodes which consume each one's output, both keyed by id."""
+    nodes, consumers = {}, {}
+    stack = list(tree.get_terminals())
+    while stack:
+        n = stack.pop()
+        if id(n) in nodes:
+            continue
+        nodes[id(n)] = n
+        consumers.setdefault(id(n), [])
+        for input in n._inputs:
+            if input is None:
+                continue
+            consumers.setdefault(id(input), []).append(n)
+            stack.append(input)
+    return nodes, consumers
+
+
+def get_consumers(n, consumers):
+    """Get the nodes which actually receive a node's output,
+    looking through ignored nodes, which pass their input on."""
+    out = []
+    for user in consumers.get(id(n), []):
+        if getattr(user, "ignored", False):
+            out.extend(get_consumers(user, consumers))
+        else:
+            out.append(user)
+    return out
+
+
+def fusable(n):
+    return hasattr(n, "image_op") and hasattr(n, "fuse") \
+            and not getattr(n, "ignored", False)
+
+
+def fuse_image_ops(tree):
+    """Collapse each run of simple image transform nodes, where
+    all but the last feed only the next, into the last one, so the
+    run is done as one operation without intermediate copies.  The
+    last node reads from the run's input and still caches its
+    result as before.  If that input is an image file read only by
+    the run, the ops are done as the file is decoded."""
+    nodes, consumers = get_graph(tree)
+    for key, n in nodes.items():
+        users = consumers[key]
+        if not fusable(n) or (len(users) == 1 and fusable(users[0])):
+            continue
+        run = []
+        input = n._inputs[0] if n._inputs else None
+        while input is not None and fusable(input) \
+                and len(consumers[id(input)]) == 1:
+            run.insert(0, input)
+            input = input._inputs[0]
+        if run and input is not None:
+            n.fuse(run, input)
+        if hasattr(input, "decode_for") and len(consumers[id(input)]) == 1 \
+                and not getattr(input, "ignored", False):
+            input.decode_for([n])
+            n.in_input = True
+    return tree
+
+
+def pass_native_images(tree):
+    """Let Ocropus image filters give their result to the next
+    Ocropus node as a native image, rather than converting it to
+    numpy and back, when every node that receives it can take one.
+    Terminal nodes always give numpy arrays."""
+    nodes, consumers = get_graph(tree)
+    for key, n in nodes.iteritems():
+        if not hasattr(n, "native_output"):
+            continue
+        users = get_consumers(n, consumers)
+        n.native_output = bool(users) and all(
+                getattr(u, "native_input", False) for u in users)
+    return tree
+
+
+def optimize(tree):
+    """Run all optimisation passes on a script."""
+    return pass_native_images(fuse_image_ops(tree))
@@ -0,0 +1,43 @@
+"""
+Vectorized operations on projection profiles, i.e. the sums of
+the rows or columns of a binary image.
+"""
+
+import numpy
+
+
+def project(array, axis):
+    """Sum an image array along the given axis."""
+    return numpy.asarray(array).sum(axis=axis)
+
+
+def high_pass(profile, threshold):
+    """Zero everything in a profile below the threshold."""
+    profile = numpy.asarray(profile)
+    return numpy.where(profile < threshold, 0, profile)
+
+
+def high_pass_max(profile, scale):
+    """Zero everything below scale times the maximum value."""
+    return high_pass(profile, numpy.max(profile) * scale)
+
+
+def high_pass_median(profile, scale):
+    """Zero everything below scale times the median value."""
+    return high_pass(profile, numpy.median(profile) * scale)
+
+
+def runs(profile):
+    """Get an N x 2 array of the (start, end) of each run of
+    non-zero values in a profile, with end exclusive.  A run
+    which reaches the end of the profile ends at len(profile)."""
+    nonzero = numpy.asarray(profile) != 0
+    edges = numpy.diff(numpy.concatenate(([False], nonzero, [False]))
+            .astype(numpy.int8))
+    return numpy.flatnonzero(edges).reshape(-1, 2)
+
+
+def average_above(values, threshold):
+    """Get the mean of the values which are at least threshold."""
+    values = numpy.asarray(values)
+    return numpy.average(values, weights=(values >= threshold).astype(int))
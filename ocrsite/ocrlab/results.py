@@ -0,0 +1,75 @@
+"""
+Channel for publishing partial results (i.e. recognized lines)
+from a running task, so they can be shown or post-processed before
+the whole page is finished.  Results are stored in the Django cache,
+which is shared between the web and worker processes when
+a memcached or database cache backend is configured.
+"""
+
+import time
+from django.core.cache import cache
+
+
+# How long results are kept after the last line is published.
+TIMEOUT = 60 * 60
+
+
+class ResultChannel(object):
+    """Ordered list of results for a given task."""
+    def __init__(self, task_id, backend=None):
+        self.task_id = task_id
+        self.cache = backend or cache
+
+    def _key(self, name):
+        return "ocrlab.results.%s.%s" % (self.task_id, name)
+
+    def publish(self, item):
+        """Append an item to the channel."""
+        self.cache.add(self._key("count"), 0, TIMEOUT)
+        index = self.cache.incr(self._key("count"))
+        self.cache.set(self._key(index), item, TIMEOUT)
+
+    def close(self):
+        """Mark the channel as finished."""
+        self.cache.set(self._key("closed"), True, TIMEOUT)
+
+    def closed(self):
+        return bool(self.cache.get(self._key("closed")))
+
+    def count(self):
+        return self.cache.get(self._key("count"), 0)
+
+    def read(self, since=0):
+        """Get the items published after the first 'since'."""
+        keys = [self._key(i) for i in range(since + 1, self.count() + 1)]
+        items = self.cache.get_many(keys)
+        out = []
+        for key in keys:
+            # stop at an item that's been counted but not yet set
+            if key not in items:
+                break
+            out.append(items[key])
+        return out
+
+    def poll(self, since=0, timeout=20.0, interval=0.25):
+        """Wait up to timeout seconds for items published after
+        the first 'since', returning as soon as there are some or
+        the channel is closed."""
+        end = time.time() + timeout
+        while True:
+            items = self.read(since)
+            if items or self.closed() or time.time() >= end:
+                return items
+            time.sleep(interval)
+
+    def follow(self, timeout=20.0):
+        """Generate items as they are published, until the channel
+        is closed or nothing arrives for timeout seconds."""
+        since = 0
+        while True:
+            items = self.poll(since, timeout=timeout)
+            for item in items:
+                yield item
+            since += len(items)
+            if not items:
+                break
@@ -0,0 +1,93 @@
+"""
+Process-wide cache of built preset scripts.  Building a script
+means parsing the preset's JSON, instantiating every node and
+running the optimize passes, which is wasted work when a worker runs
+the same preset on page after page, so built scripts are kept and
+reused, with only their input rebound for each task.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+# Number of distinct presets to keep scripts for.
+DEFAULT_SIZE = 16
+
+# Number of idle copies of each to keep, i.e. for threads
+# running the same preset at once.
+DEFAULT_COPIES = 4
+
+
+def get_key(preset):
+    """Get the cache key of a preset's script: its id, when it
+    was last modified, and a digest of its data (since the
+    modification date is only to the day)."""
+    data = preset.data
+    if isinstance(data, unicode):
+        data = data.encode("utf8")
+    return (preset.pk, str(preset.updated_on), hashlib.md5(data).hexdigest())
+
+
+class ScriptCache(object):
+    """LRU cache of built scripts, keyed by preset.  A script can
+    only be evaluated by one task at a time, so scripts are checked
+    out for the duration of a task and checked back in afterwards,
+    and if every copy of one is in use another is built."""
+    def __init__(self, size=DEFAULT_SIZE, copies=DEFAULT_COPIES, logger=None):
+        self.size = size
+        self.copies = copies
+        self.logger = logger or logging.getLogger(__name__)
+        self._scripts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def checkout(self, preset, build):
+        """Get a script for a preset, building it with build(preset)
+        if no idle copy is cached.  Returns the cache key and script."""
+        key = get_key(preset)
+        with self._lock:
+            idle = self._scripts.pop(key, None)
+            if idle is None:
+                self._evict(key)
+                idle = []
+            self._scripts[key] = idle
+            if idle:
+                return key, idle.pop()
+        self.logger.debug("Building script for preset %s", key[0])
+        return key, build(preset)
+
+    def checkin(self, key, script):
+        """Return a script to the cache, once a task is done with it."""
+        with self._lock:
+            idle = self._scripts.get(key)
+            if idle is not None and len(idle) < self.copies:
+                idle.append(script)
+
+    @contextmanager
+    def script(self, preset, build):
+        """Check out a script for the duration of a with block.  It
+        isn't checked back in if the block raises, in case it was
+        left in a bad state."""
+        key, script = self.checkout(preset, build)
+        yield script
+        self.checkin(key, script)
+
+    def _evict(self, key):
+        """Drop old versions of the preset in key, and the least
+        recently used presets if there are too many.  Must be
+        called with the lock held."""
+        for other in self._scripts.keys():
+            if other[0] == key[0]:
+                del self._scripts[other]
+        while self._scripts and len(self._scripts) >= self.size:
+            self._scripts.popitem(last=False)
+
+    def clear(self):
+        """Drop everything."""
+        with self._lock:
+            self._scripts.clear()
+
+
+cache = ScriptCache()
@@ -1,28 +1,119 @@
 """Asyncronous tasks, run with Celery."""
 
 import json
-from celery import task
+import logging
+from celery import task, signals
+from celery.task import chord
+from django.conf import settings
 
-from ocrlab import models, nodes, stages
+from ocrlab import hocr, models, nodes, optimize, scriptcache, stages, types
+from ocrlab.modelregistry import registry
+from ocrlab.results import ResultChannel
 
 from nodetree import script
 
 
+@signals.worker_init.connect
+def preload_models(sender=None, **kwargs):
+    """Load the models listed in settings.OCRLAB_PRELOAD_MODELS when
+    a worker starts, before the pool forks, so that the children
+    share their pages copy-on-write."""
+    logger = logging.getLogger(__name__)
+    for nodetype, params in getattr(settings, "OCRLAB_PRELOAD_MODELS", []):
+        modname, clsname = nodetype.split(".")
+        klass = getattr(nodes.load(modname), clsname)
+        klass.preload(**params)
+    for stats in registry.stats():
+        logger.info("Preloaded %(path)s: %(loadtime)0.2fs, %(memory)d bytes",
+                stats)
+
+
 class OcrTask(task.Task):
     name = "ocrlab.OcrTask"
 
     def run(self, preset_id, filepath):
         preset = models.Preset.objects.get(pk=preset_id)
-        with open(filepath, "r") as handle:
-            return self.run_preset(preset, handle)
+        channel = ResultChannel(self.request.id)
+        try:
+            with open(filepath, "r") as handle:
+                return self.run_preset(preset, handle,
+                        progress_func=self.set_progress,
+                        result_func=channel.publish)
+        finally:
+            channel.close()
+
+    def set_progress(self, percent, total):
+        """Report progress, as shown by the progress view."""
+        self.update_state(state="PROGRESS",
+                meta=dict(current=percent, total=100))
+
+    @classmethod
+    def run_preset(cls, preset, handle, progress_func=None, result_func=None):
+        """Run a preset on the given handle.  If given, result_func
+        is called with each line of text as soon as it's recognized.
+        If the input is a multi-page file the preset is run on each
+        page in turn, so only one is in memory at a time, and the
+        results are joined.  The preset's script is reused from the
+        worker's script cache if possible."""
+        with scriptcache.cache.script(preset, cls.build_script) as s:
+            try:
+                return cls.run_script(s, handle, progress_func=progress_func,
+                        result_func=result_func)
+            finally:
+                # don't keep the input, or this task's callbacks,
+                # alive in the cache
+                cls._set_script_input(s, "")
+                cls._set_script_callbacks(s, None, None)
+
+    @classmethod
+    def build_script(cls, preset):
+        """Build and optimise a preset's script."""
+        s = script.Script(nodes.load_for_script(json.loads(preset.data)))
+        return optimize.optimize(s)
 
     @classmethod
-    def run_preset(cls, preset, handle):
-        """Run a preset on the given handle."""
-        s = script.Script(json.loads(preset.data))
+    def run_script(cls, s, handle, progress_func=None, result_func=None):
+        """Run a built script on the given handle."""
         s = cls._set_script_input(s, handle)
+        input = s.get_nodes_by_attr("stage", stages.INPUT)[0]
+        numpages = input.page_count() if hasattr(input, "page_count") else 1
+        current = [0]
+        def page_progress(percent, total):
+            progress_func((current[0] * 100.0 + percent) / numpages, total)
+        if progress_func is not None and numpages > 1:
+            s = cls._set_script_callbacks(s, page_progress, result_func)
+        else:
+            s = cls._set_script_callbacks(s, progress_func, result_func)
         term = s.get_terminals()[0]
-        return term.eval()
+        if numpages <= 1:
+            if hasattr(input, "page_count"):
+                input.set_param("page", 0)
+            return cls._serialise(term.eval())
+        results = []
+        for page in range(numpages):
+            current[0] = page
+            input.set_param("page", page)
+            results.append(cls._serialise(term.eval()))
+        return cls._join_pages(term, results)
+
+    @classmethod
+    def _serialise(cls, result):
+        """Convert a script's result into something which can be
+        handed out, i.e. a segmentation into plain JSON data."""
+        if isinstance(result, types.Segmentation):
+            return result.to_dict()
+        return result
+
+    @classmethod
+    def _join_pages(cls, term, results):
+        """Join the results for each page of a multi-page input.
+        Text is joined into one document, anything else (i.e.
+        segmentations) is returned as a list."""
+        if term.outtype is types.HocrString:
+            return hocr.concatenate(results)
+        if all(isinstance(r, basestring) for r in results):
+            return u"\n".join(results)
+        return results
 
     @classmethod
     def _set_script_input(cls, tree, handle):
@@ -32,4 +123,85 @@ class OcrTask(task.Task):
         input.set_param("path", handle)
         return tree
 
+    @classmethod
+    def _set_script_callbacks(cls, tree, progress_func, result_func):
+        """Hook the recognizers up to the given callbacks, replacing
+        any left from a previous run of a cached script."""
+        for rec in tree.get_nodes_by_attr("stage", stages.RECOGNIZE):
+            rec.progress_func = progress_func
+            rec.result_func = result_func
+        return tree
+
+
+class OcrBatchTask(task.Task):
+    """Run a preset on many inputs, i.e. the pages of a book.  The
+    inputs are split into chunks which are run in parallel, each by
+    a single worker, which reuses the preset's script and models
+    from one input to the next.  The manifest of results, in input
+    order, is the result of another task, which start returns; run
+    as a task, the result is that task's id, so the manifest is
+    celery.result.AsyncResult(id).get()."""
+    name = "ocrlab.OcrBatchTask"
+
+    def run(self, preset_id, filepaths, chunk_size=None):
+        return self.start(preset_id, filepaths, chunk_size).task_id
+
+    @classmethod
+    def start(cls, preset_id, filepaths, chunk_size=None):
+        """Start the tasks for each chunk of a batch, returning the
+        AsyncResult of the manifest."""
+        chunks = cls.get_chunks(filepaths, chunk_size)
+        if not chunks:
+            return OcrBatchManifestTask.delay([])
+        header = [OcrBatchChunkTask.subtask((preset_id, chunk))
+                for chunk in chunks]
+        return chord(header)(OcrBatchManifestTask.subtask())
+
+    @classmethod
+    def get_chunks(cls, filepaths, chunk_size=None):
+        """Split the inputs into lists of (index, filepath) pairs
+        of at most chunk_size, or settings.OCRLAB_BATCH_CHUNK_SIZE."""
+        if chunk_size is None:
+            chunk_size = getattr(settings, "OCRLAB_BATCH_CHUNK_SIZE", 10)
+        chunk_size = max(1, int(chunk_size))
+        items = list(enumerate(filepaths))
+        return [items[i:i + chunk_size]
+                for i in range(0, len(items), chunk_size)]
+
+
+class OcrBatchChunkTask(task.Task):
+    """Run a preset on a chunk of a batch's inputs, given as
+    (index, filepath) pairs.  A failed input doesn't stop the
+    rest; its error is recorded in the results instead."""
+    name = "ocrlab.OcrBatchChunkTask"
+
+    def run(self, preset_id, items):
+        logger = logging.getLogger(__name__)
+        preset = models.Preset.objects.get(pk=preset_id)
+        results = []
+        for done, (index, filepath) in enumerate(items):
+            self.update_state(state="PROGRESS",
+                    meta=dict(current=done * 100 / len(items), total=100))
+            result = dict(index=index, path=filepath, result=None, error=None)
+            try:
+                with open(filepath, "r") as handle:
+                    result["result"] = OcrTask.run_preset(preset, handle,
+                            progress_func=None, result_func=None)
+            except Exception, err:
+                logger.exception("Batch input %d failed: %s", index, filepath)
+                result["error"] = "%s: %s" % (err.__class__.__name__, err)
+            results.append(result)
+        return results
+
+
+class OcrBatchManifestTask(task.Task):
+    """Gather the results of a batch's chunks into a manifest,
+    ordered by input index."""
+    name = "ocrlab.OcrBatchManifestTask"
 
+    def run(self, chunks):
+        results = sorted((r for chunk in chunks for r in chunk),
+                key=lambda r: r["index"])
+        return dict(count=len(results),
+                failed=len([r for r in results if r["error"] is not None]),
+                results=results)
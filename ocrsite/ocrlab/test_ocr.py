@@ -13,7 +13,7 @@ from nodetree import script, registry
 
 
 def run(nodelist, outpath):
-    s = script.Script(nodelist)
+    s = script.Script(nodetree_nodes.load_for_script(nodelist))
     term = s.get_terminals()[0]
     print "Rendering to %s" % outpath
     os.environ["NODETREE_WRITE_FILEOUT"] = "1"
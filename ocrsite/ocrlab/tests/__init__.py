@@ -1,3 +1,15 @@
 
 from test_core import *
 from test_nodes import *
+from test_hocr import *
+from test_geometry import *
+from test_projection import *
+from test_components import *
+from test_types import *
+from test_tiling import *
+from test_optimize import *
+from test_imageops import *
+from test_graph import *
+from test_scriptcache import *
+from test_ocropus import *
+from test_tasks import *
@@ -0,0 +1,60 @@
+"""
+    Test connected component analysis.
+"""
+import numpy
+from django.test import TestCase
+
+from ocrlab import components, analysis
+
+
+class ComponentsTest(TestCase):
+    def setUp(self):
+        """
+            Make an image with an L shape, a diagonal pair of
+            pixels and a dot.
+        """
+        self.image = numpy.zeros((10, 8), dtype=numpy.uint8)
+        self.image[1:5, 1] = 1
+        self.image[4, 1:4] = 1
+        self.image[6, 5] = self.image[7, 6] = 1
+        self.image[9, 0] = 1
+
+    def test_measurements(self):
+        """
+        Test boxes, areas and centroids of each component, in
+        the order iulib labels them.
+        """
+        comps = components.find_components(self.image)
+        self.assertEqual(len(comps), 3)
+        self.assertEqual(comps.boxes.tolist(),
+                [[0, 9, 1, 10], [1, 1, 4, 5], [5, 6, 7, 8]])
+        self.assertEqual(comps.areas.tolist(), [1, 6, 2])
+        self.assertEqual(comps.centroids[2].tolist(), [5.5, 6.5])
+
+    def test_flipped_rects(self):
+        """
+        Test boxes can be had in bottom-origin coords.
+        """
+        rects = components.find_components(self.image).rects(flip=True)
+        self.assertEqual(rects.data.tolist(),
+                [[0, 0, 1, 1], [1, 5, 4, 9], [5, 2, 7, 4]])
+        empty = components.find_components(numpy.zeros((4, 4)))
+        self.assertEqual(len(empty.rects()), 0)
+
+
+class PageAnalysisTest(TestCase):
+    def test_shared(self):
+        """
+        Test a page's analysis is computed once and shared until
+        the page goes away.
+        """
+        page = numpy.ones((20, 10), dtype=numpy.uint8) * 255
+        page[2:8, 3:5] = 0
+        first = analysis.get_analysis(page)
+        self.assertTrue(analysis.get_analysis(page) is first)
+        self.assertFalse(analysis.get_analysis(page.copy()) is first)
+        self.assertEqual(first.boxes.data.tolist(), [[3, 2, 5, 8]])
+        self.assertEqual(first.average_char_height, 6)
+        self.assertTrue(first.components is first.components)
+        del page
+        self.assertEqual(len(analysis._analyses), 0)
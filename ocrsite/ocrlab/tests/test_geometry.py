@@ -0,0 +1,78 @@
+"""
+    Test rectangle geometry.
+"""
+import random
+from django.test import TestCase
+
+from ocrlab.geometry import Rectangle, RectArray, IntervalIndex
+
+
+class RectArrayTest(TestCase):
+    def setUp(self):
+        """
+            Make some random rects, including empty ones.
+        """
+        rand = random.Random(42)
+        self.rects = []
+        for i in range(200):
+            x0, y0 = rand.randint(0, 100), rand.randint(0, 100)
+            self.rects.append(Rectangle(x0, y0,
+                    x0 + rand.randint(-5, 30), y0 + rand.randint(-5, 30)))
+        self.rects = [r for r in self.rects if r.empty() or r.height()]
+        self.array = RectArray.from_rects(self.rects)
+
+    def test_measurements(self):
+        """
+        Test vectorized measurements match Rectangle's.
+        """
+        self.assertEqual(list(self.array.area()),
+                [r.area() for r in self.rects])
+        self.assertEqual(list(self.array.aspect()),
+                [r.aspect() for r in self.rects])
+        self.assertEqual(list(self.array.empty()),
+                [r.empty() for r in self.rects])
+
+    def test_overlaps(self):
+        """
+        Test vectorized overlap tests match Rectangle's.
+        """
+        query = Rectangle(20, 30, 60, 50)
+        self.assertEqual(list(self.array.overlaps(query)),
+                [r.overlaps(query) for r in self.rects])
+        self.assertEqual(list(self.array.overlaps_y(query)),
+                [r.overlaps_y(query) for r in self.rects])
+
+    def test_union(self):
+        """
+        Test the union of an array matches Rectangle.union_of.
+        """
+        for start in range(0, 50, 5):
+            rects = self.rects[start:start + 10]
+            self.assertEqual(RectArray.from_rects(rects).union(),
+                    Rectangle.union_of(*rects))
+        self.assertEqual(RectArray().union(), Rectangle.union_of())
+        empty = [Rectangle(5, 5, 1, 1), Rectangle(8, 8, 2, 2)]
+        self.assertEqual(RectArray.from_rects(empty).union(),
+                Rectangle.union_of(*empty))
+
+    def test_sort_and_filter(self):
+        """
+        Test sorting is stable and filtering returns rects.
+        """
+        bytop = sorted(self.rects, lambda x, y: cmp(x.y1, y.y1))
+        self.assertEqual(list(self.array.sort_by(self.array.y1)), bytop)
+        big = self.array[self.array.area() > 100]
+        self.assertEqual(list(big), [r for r in self.rects if r.area() > 100])
+
+    def test_interval_index(self):
+        """
+        Test index queries find the same rects as a scan.
+        """
+        index = IntervalIndex(self.array)
+        for y0 in range(-10, 140, 7):
+            query = Rectangle(20, y0, 60, y0 + 12)
+            self.assertEqual(list(index.overlaps_y(query)),
+                    [i for i, r in enumerate(self.rects) if r.overlaps_y(query)])
+            self.assertEqual(list(index.overlaps(query)),
+                    [i for i, r in enumerate(self.rects) if r.overlaps(query)])
+        self.assertEqual(len(IntervalIndex(RectArray()).overlaps(query)), 0)
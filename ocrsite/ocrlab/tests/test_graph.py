@@ -0,0 +1,49 @@
+"""
+    Test script layouts.
+"""
+from django.test import TestCase
+
+from ocrlab import graph
+
+
+def script(**inputs):
+    return dict((name, dict(inputs=list(i))) for name, i in inputs.items())
+
+
+class GraphTest(TestCase):
+    def setUp(self):
+        # a typical preset, with a shared input
+        self.nodes = script(input=[], gray=["input"], binarize=["gray"],
+                segment=["binarize"], recognize=["binarize", "segment"],
+                other=["input"])
+
+    def test_layers(self):
+        """
+        Test inputs are above their nodes, and nodes in the same
+        layer don't overlap.
+        """
+        pos = graph.get_node_positions(self.nodes)
+        for name, node in self.nodes.items():
+            for i in node["inputs"]:
+                self.assertTrue(pos[i][1] > pos[name][1])
+        self.assertEqual(pos["gray"][1], pos["other"][1])
+        self.assertTrue(abs(pos["gray"][0] - pos["other"][0])
+                >= graph.NODE_SIZE + graph.NODE_SEP)
+
+    def test_small(self):
+        """
+        Test scripts of one node, or with a cycle, can be laid out.
+        """
+        self.assertEqual(len(graph.get_node_positions(script(a=[]))), 1)
+        pos = graph.get_node_positions(script(a=["b"], b=["a"], c=["b"]))
+        self.assertEqual(sorted(pos), ["a", "b", "c"])
+
+    def test_cached(self):
+        """
+        Test layouts are cached by structure, not node details.
+        """
+        pos = graph.get_node_positions(self.nodes)
+        self.nodes["gray"]["params"] = [["scale", 2]]
+        key = graph.get_layout_key(self.nodes)
+        self.assertTrue(key in graph._cache)
+        self.assertEqual(graph.get_node_positions(self.nodes), pos)
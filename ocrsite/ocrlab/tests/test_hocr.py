@@ -0,0 +1,89 @@
+"""
+    Test the hOCR serializer.
+"""
+import os
+from django.test import TestCase
+from django.template import Template, Context
+
+from ocrlab import hocr
+
+
+class HocrTest(TestCase):
+    def setUp(self):
+        """
+            Load the old hOCR template for comparison.
+        """
+        with open(os.path.join(os.path.dirname(hocr.__file__),
+                "templates", "hocr_template.html"), "r") as tmpl:
+            self.template = Template(tmpl.read())
+
+    def assertSameAsTemplate(self, pagedata):
+        self.assertEqual(hocr.hocr_from_data(pagedata),
+                unicode(self.template.render(Context(pagedata))))
+
+    def test_empty_page(self):
+        """
+        Test a page with no lines.
+        """
+        self.assertSameAsTemplate(dict(bbox=[0, 0, 100, 200], lines=[]))
+        self.assertSameAsTemplate(dict())
+
+    def test_lines(self):
+        """
+        Test lines are output identically, including escaping.
+        """
+        self.assertSameAsTemplate(dict(
+            bbox=[0, 0, 100, 200],
+            file="<page>.png",
+            dc_title="Jack & Jill",
+            lines=[
+                dict(index=1, bbox=[1, 2, 3, 4], text=u"It's \"quoted\""),
+                dict(index=2, bbox=[5, 6, 7, 8], text=u"<b>caf\u00e9</b>"),
+                dict(index=3, bbox=[9, 10], text=None),
+            ]))
+
+    def test_stream(self):
+        """
+        Test writing a page a line at a time.
+        """
+        from io import BytesIO
+        buf = BytesIO()
+        writer = hocr.HocrWriter(buf, encoding="utf8")
+        pagedata = dict(bbox=[0, 0, 10, 10], lines=[
+            dict(index=1, bbox=[0, 0, 10, 5], text=u"caf\u00e9")])
+        writer.write_header(pagedata)
+        writer.write_line(pagedata["lines"][0])
+        writer.write_footer()
+        self.assertEqual(buf.getvalue().decode("utf8"),
+                hocr.hocr_from_data(pagedata))
+
+    def test_merge_columns(self):
+        """
+        Test merging columns offsets bboxes and renumbers lines.
+        """
+        col1 = hocr.hocr_from_data(dict(bbox=[0, 0, 50, 50], lines=[
+            dict(index=1, bbox=[1, 2, 3, 4], text=u"one"),
+            dict(index=2, bbox=[5, 6, 7, 8], text=u"two")]))
+        col2 = hocr.hocr_from_data(dict(bbox=[0, 0, 50, 50], lines=[
+            dict(index=1, bbox=[1, 2, 3, 4], text=u"three")]))
+        merged = hocr.parse(hocr.merge_columns([col1, col2],
+                [(0, 0), (100, 10)], dict(bbox=[0, 0, 150, 60])))
+        lines = merged.find_class("ocr_line")
+        self.assertEqual([l.text for l in lines], ["one", "two", "three"])
+        self.assertEqual([l.get("id") for l in lines],
+                ["line_1", "line_2", "line_3"])
+        self.assertEqual(lines[2].get("title"), "bbox 101 12 103 14")
+
+    def test_concatenate(self):
+        """
+        Test joining documents keeps each page and renumbers ids.
+        """
+        pages = [hocr.hocr_from_data(dict(bbox=[0, 0, 50, 50], lines=[
+            dict(index=1, bbox=[1, 2, 3, 4], text=text)]))
+            for text in (u"one", u"two")]
+        doc = hocr.parse(hocr.concatenate(pages, dict(dc_title=u"Book")))
+        self.assertEqual([p.get("id") for p in doc.find_class("ocr_page")],
+                ["page_1", "page_2"])
+        lines = doc.find_class("ocr_line")
+        self.assertEqual([l.text for l in lines], ["one", "two"])
+        self.assertEqual([l.get("id") for l in lines], ["line_1", "line_2"])
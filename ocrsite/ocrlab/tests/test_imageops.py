@@ -0,0 +1,192 @@
+"""
+    Test fused image transforms.
+"""
+import struct
+import StringIO
+
+import numpy
+from PIL import Image
+from django.test import TestCase
+
+from ocrlab import imageops
+
+
+def write_strip_tiff(fp, gray, rows, missing=()):
+    """Write an uncompressed gray TIFF with the given number of rows
+    per strip, which PIL won't.  The strips numbered in missing are
+    said to be past the end of the file, so can't be decoded."""
+    height, width = gray.shape
+    strips = range(0, height, rows)
+    count = len(strips)
+    offsets_at = 8 + 2 + 9 * 12 + 4
+    counts_at = offsets_at + 4 * count
+    data_at = counts_at + 4 * count
+    entries = [(256, 4, 1, width), (257, 4, 1, height), (258, 3, 1, 8),
+            (259, 3, 1, 1), (262, 3, 1, 1), (273, 4, count, offsets_at),
+            (277, 3, 1, 1), (278, 4, 1, rows), (279, 4, count, counts_at)]
+    fp.write("II*\0" + struct.pack("<I", 8))
+    fp.write(struct.pack("<H", len(entries)))
+    for tag, kind, num, value in entries:
+        fp.write(struct.pack("<HHII", tag, kind, num, value))
+    fp.write(struct.pack("<I", 0))
+    data = [gray[y:y + rows].tostring() for y in strips]
+    offsets, pos = [], data_at
+    for i, strip in enumerate(data):
+        offsets.append(pos if i not in missing else 1 << 30)
+        pos += len(strip)
+    fp.write(struct.pack("<%dI" % count, *offsets))
+    fp.write(struct.pack("<%dI" % count, *[len(d) for d in data]))
+    fp.write("".join(data))
+    fp.seek(0)
+
+
+class ImageOpsTest(TestCase):
+    def setUp(self):
+        self.rgb = numpy.random.RandomState(0).randint(
+                0, 255, (101, 77, 3)).astype(numpy.uint8)
+        self.gray = numpy.asarray(Image.fromarray(self.rgb).convert("L"))
+
+    def test_crop_view(self):
+        """
+        Test crops and rotations of a gray image are views.
+        """
+        ops = [imageops.crop(5, -1, 40, 60), imageops.rotate(1)]
+        out = imageops.run(self.gray, ops)
+        self.assertTrue(out.base is not None)
+        self.assertTrue(numpy.all(out == numpy.rot90(self.gray[:60, 5:40])))
+
+    def test_single_conversion(self):
+        """
+        Test a color image comes out gray, however many ops convert.
+        """
+        ops = [imageops.gray(), imageops.crop(10, 10, 50, 50),
+                imageops.gray()]
+        out = imageops.run(self.rgb, ops)
+        self.assertEqual(out.dtype, numpy.uint8)
+        self.assertTrue(numpy.all(out == self.gray[10:50, 10:50]))
+
+    def test_scale_then_crop(self):
+        """
+        Test cropping a nearest-neighbour scale only computes the
+        crop, with the same result as scaling the whole image.
+        """
+        for factor in (0.33, 0.5, 1.7, 2.0):
+            pil = Image.fromarray(self.gray)
+            size = int(77 * factor), int(101 * factor)
+            expected = numpy.asarray(pil.resize(size, Image.NEAREST))[7:50, 5:40]
+            out = imageops.run(self.gray, [imageops.scale(factor),
+                    imageops.crop(5, 7, 40, 50)])
+            self.assertTrue(numpy.all(out == expected))
+
+    def test_scale_then_crop_random(self):
+        """
+        Test fused scales and crops of random sizes give exactly
+        what the nodes would unfused.
+        """
+        rand = numpy.random.RandomState(1)
+        cases = [((104, 111), 2.5, (13, 22, 229, 124))]
+        for i in range(200):
+            shape = tuple(rand.randint(1, 200, 2))
+            factor = rand.uniform(0.1, 4.0)
+            width, height = int(shape[1] * factor), int(shape[0] * factor)
+            x0, x1 = sorted(rand.randint(-1, width + 2, 2))
+            y0, y1 = sorted(rand.randint(-1, height + 2, 2))
+            cases.append((shape, factor, (x0, y0, x1, y1)))
+        for shape, factor, box in cases:
+            image = rand.randint(0, 255, shape).astype(numpy.uint8)
+            scaled = imageops.run(image, [imageops.scale(factor)])
+            expected = imageops.run(scaled, [imageops.crop(*box)])
+            out = imageops.run(image, [imageops.scale(factor),
+                    imageops.crop(*box)])
+            self.assertEqual(out.shape, expected.shape)
+            self.assertTrue(numpy.all(out == expected),
+                    (shape, factor, box))
+
+    def test_filtered_scale(self):
+        """
+        Test scales which mix pixels, or of bilevel images, are done
+        before converting, as they would be unfused.
+        """
+        rgb = Image.fromarray(self.rgb)
+        expected = rgb.resize((38, 50), Image.BILINEAR).convert("L")
+        out = imageops.run(self.rgb, [imageops.gray(),
+                imageops.resize((38, 50), "BILINEAR")])
+        self.assertTrue(numpy.all(out == numpy.asarray(expected)))
+        bilevel = Image.fromarray(self.gray).convert("1")
+        expected = bilevel.resize((38, 50), Image.BILINEAR).convert("L")
+        out = imageops.run(bilevel, [imageops.scale(0.5, "BILINEAR")])
+        self.assertTrue(numpy.all(out == numpy.asarray(expected)))
+
+    def test_crop_box(self):
+        """
+        Test crop boxes are clipped like numpy slices.
+        """
+        self.assertEqual(imageops.get_crop_box(
+                imageops.crop(-1, 10, 500, None), 77, 101), (0, 10, 77, 101))
+        self.assertEqual(imageops.get_crop_box(
+                imageops.crop(50, 10, 20, 5), 77, 101), (50, 10, 50, 10))
+
+    def test_decode_draft(self):
+        """
+        Test a scaled JPEG is decoded at reduced size, but comes
+        out at the requested size.
+        """
+        big = Image.fromarray(self.rgb).resize((770, 1010))
+        fp = StringIO.StringIO()
+        big.save(fp, "JPEG")
+        fp.seek(0)
+        out = imageops.decode(fp, [imageops.scale(0.2)])
+        self.assertEqual(out.shape, (202, 154))
+        self.assertEqual(out.dtype, numpy.uint8)
+
+    def test_decode_crop(self):
+        """
+        Test decoding with a crop gives the same pixels as cropping.
+        """
+        fp = StringIO.StringIO()
+        Image.fromarray(self.rgb).save(fp, "TIFF")
+        fp.seek(0)
+        out = imageops.decode(fp, [imageops.crop(5, 20, 30, 60)],
+                as_gray=True)
+        self.assertTrue(numpy.all(out == self.gray[20:60, 5:30]))
+
+    def test_decode_crop_strips(self):
+        """
+        Test decoding a TIFF with a crop only decodes the strips
+        which overlap it.
+        """
+        fp = StringIO.StringIO()
+        write_strip_tiff(fp, self.gray, 16)
+        self.assertEqual(len(imageops.open_image(fp).tile), 7)
+        out = imageops.decode(fp, [imageops.crop(5, 20, 30, 60)])
+        self.assertTrue(numpy.all(out == self.gray[20:60, 5:30]))
+        # strips 0 and 4 on can't be read, but aren't needed
+        fp = StringIO.StringIO()
+        write_strip_tiff(fp, self.gray, 16, missing=(0, 4, 5, 6))
+        self.assertRaises(IOError, imageops.open_image(fp).load)
+        out = imageops.decode(fp, [imageops.crop(5, 20, 30, 60)])
+        self.assertTrue(numpy.all(out == self.gray[20:60, 5:30]))
+
+    def test_decode_page(self):
+        """
+        Test reading a page beyond the last of a file fails.
+        """
+        fp = StringIO.StringIO()
+        Image.fromarray(self.rgb).save(fp, "TIFF")
+        self.assertEqual(imageops.count_pages(fp), 1)
+        self.assertEqual(imageops.decode(fp, page=0).shape, (101, 77, 3))
+        self.assertRaises(EOFError, imageops.decode, fp, page=1)
+
+    def test_sources(self):
+        """
+        Test images can be read from paths, file objects and data.
+        """
+        fp = StringIO.StringIO()
+        Image.fromarray(self.rgb).save(fp, "PNG")
+        data = fp.getvalue()
+        self.assertTrue(imageops.is_path("/no/such/file.png"))
+        self.assertTrue(imageops.is_missing("/no/such/file.png"))
+        self.assertFalse(imageops.is_path(data))
+        for source in (fp, data, bytearray(data), buffer(data)):
+            out = imageops.decode(source, as_gray=True)
+            self.assertTrue(numpy.all(out == self.gray))
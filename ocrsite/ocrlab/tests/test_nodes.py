@@ -10,7 +10,7 @@ from django.conf import settings
 from nodetree import script, node, exceptions
 import numpy
 
-from ocrlab import nodes
+from ocrlab import nodes as ocrnodes
 
 VALID_SCRIPTDIR = "ocrlab/scripts/valid"
 INVALID_SCRIPTDIR = "ocrlab/scripts/invalid"
@@ -45,14 +45,15 @@ class ScriptsTest(TestCase):
         for name, nodes in self.validscripts.iteritems():
             if name.startswith("invalid"):
                 continue
-            s = script.Script(nodes)
+            s = script.Script(ocrnodes.load_for_script(nodes))
             terms = s.get_terminals()
             self.assertTrue(len(terms) > 0, msg="No terminal nodes found.")
 
             # check we get an expected type from evaling the nodes
             for n in terms:
                 out = n.eval()
-                self.assertIn(type(out), (unicode, dict, list, numpy.ndarray),
+                self.assertTrue(isinstance(out,
+                        (unicode, dict, list, numpy.ndarray)),
                         msg="Unexpected output type for node %s: %s" % (
                             n.name, type(out)))
 
@@ -63,7 +64,7 @@ class ScriptsTest(TestCase):
         for name, nodes in self.invalidscripts.iteritems():
             if not name.startswith("invalid"):
                 continue
-            s = script.Script(nodes)
+            s = script.Script(ocrnodes.load_for_script(nodes))
             terms = s.get_terminals()
             self.assertTrue(len(terms) > 0, msg="No terminal nodes found.")
             # check we get an expected type from evaling the nodes
@@ -0,0 +1,142 @@
+"""
+    Test Ocropus node classes.
+"""
+import numpy
+from django.test import TestCase
+
+import ocrolib
+from ocrlab.nodes import ocropus
+
+
+def threshold(image):
+    return numpy.where(numpy.asarray(image) > 127, 255, 0).astype(numpy.uint8)
+
+
+def invert(image):
+    return 255 - numpy.asarray(image)
+
+
+class FakeNative(object):
+    """Native component, working on iulib bytearrays."""
+    def __init__(self, func, fail=False):
+        self.func = func
+        self.fail = fail
+        self.calls = 0
+
+    def run(self, out, input):
+        if self.fail:
+            raise TypeError("in method 'binarize', argument 2")
+        self.calls += 1
+        out.copy(ocrolib.numpy2narray(
+                self.func(ocrolib.narray2numpy(input)), "B"))
+    binarize = cleanup = run
+
+
+class FakeComponent(object):
+    """Python wrapper of a FakeNative, working on numpy arrays."""
+    def __init__(self, func, fail=False):
+        self.func = func
+        self.comp = FakeNative(func, fail)
+
+    def binarize(self, input, type="B"):
+        return self.func(input), input
+
+    def cleanup(self, input, type="B"):
+        return self.func(input)
+
+
+def make_node(base, comp, native_output=False):
+    klass = type("Fake%s" % base.__name__, (base,),
+            dict(_comp=comp, _schema=[]))
+    n = klass(label=klass.__name__)
+    n.native_output = native_output
+    return n
+
+
+class OcropusNodeClassTest(TestCase):
+    def setUp(self):
+        self.schemas = ocropus.Manager._schemas
+        self.classes = ocropus.Manager._classes
+        ocropus.Manager._classes = {}
+        ocropus.Manager._schemas = [
+            dict(name="BinarizeBySauvola", interface="IBinarize",
+                parameters=[dict(name="k", value="0.3")]),
+            dict(name="BinarizeByOtsu", interface="IBinarize", parameters=[]),
+            dict(name="DeskewPageByRAST", interface="ICleanupBinary",
+                parameters=[]),
+        ]
+
+    def tearDown(self):
+        ocropus.Manager._schemas = self.schemas
+        ocropus.Manager._classes = self.classes
+
+    def get_parameter_names(self, name):
+        klass = ocropus.Manager.get_node_class(name)
+        return [p["name"] for p in klass.parameters]
+
+    def test_local_components_tiled(self):
+        """
+        Test local components can be run in tiles.
+        """
+        self.assertEqual(self.get_parameter_names("BinarizeBySauvola"),
+                ["k", "tile_size", "tile_halo", "tile_workers"])
+
+    def test_global_components_not_tiled(self):
+        """
+        Test global components aren't offered tiling parameters.
+        """
+        for name in ("BinarizeByOtsu", "DeskewPageByRAST"):
+            self.assertEqual(self.get_parameter_names(name), [])
+            self.assertFalse(ocropus.Manager.get_node_class(name).tileable)
+
+
+class NativeImageTest(TestCase):
+    def setUp(self):
+        self.page = numpy.random.RandomState(0).randint(
+                0, 255, (40, 30)).astype(numpy.uint8)
+
+    def test_native_chain(self):
+        """
+        Test a chain of native images gives the same result as
+        going through numpy.
+        """
+        binarize = make_node(ocropus.OcropusBinarizeBase,
+                FakeComponent(threshold), native_output=True)
+        cleanup = make_node(ocropus.OcropusBinaryFilterBase,
+                FakeComponent(invert))
+        binary = binarize.process(self.page)
+        self.assertTrue(isinstance(binary, ocropus.NativeImage))
+        out = cleanup.process(binary)
+        self.assertTrue(isinstance(out, numpy.ndarray))
+        self.assertEqual(binarize._comp.comp.calls, 1)
+        self.assertEqual(cleanup._comp.comp.calls, 1)
+        self.assertTrue(numpy.all(out == invert(threshold(self.page))))
+        binarize.native_output = False
+        self.assertTrue(numpy.all(binarize.process(self.page) == binary))
+        self.assertEqual(binarize._comp.comp.calls, 1)
+
+    def test_type_error_fallback(self):
+        """
+        Test components whose native interface can't be called
+        are run on numpy arrays instead.
+        """
+        binarize = make_node(ocropus.OcropusBinarizeBase,
+                FakeComponent(threshold, fail=True), native_output=True)
+        out = binarize.process(self.page)
+        self.assertTrue(isinstance(out, numpy.ndarray))
+        self.assertTrue(numpy.all(out == threshold(self.page)))
+
+    def test_converted_once(self):
+        """
+        Test a native image is converted to numpy once, however
+        it's used.
+        """
+        image = ocropus.NativeImage(ocrolib.numpy2narray(self.page, "B"))
+        array = numpy.asarray(image)
+        # each is a view of the one conversion
+        self.assertTrue(numpy.may_share_memory(numpy.asarray(image), array))
+        self.assertTrue(numpy.may_share_memory(image.numpy(), array))
+        self.assertTrue(numpy.all(array == self.page))
+        self.assertTrue(numpy.all((image == 0) == (self.page == 0)))
+        self.assertTrue(numpy.all((self.page < image) == False))
+        self.assertTrue(numpy.all(-image == -self.page))
@@ -0,0 +1,118 @@
+"""
+    Test the script optimisation passes.
+"""
+from django.test import TestCase
+
+from ocrlab import optimize
+
+
+class FakeNode(object):
+    """Just enough of a node for walking a script."""
+    def __init__(self, name, *inputs, **attrs):
+        self.name = name
+        self._inputs = list(inputs)
+        self.ignored = False
+        self.__dict__.update(attrs)
+
+
+class FakeScript(object):
+    def __init__(self, *terminals):
+        self.terminals = list(terminals)
+
+    def get_terminals(self):
+        return self.terminals
+
+
+def native_filter(name, *inputs):
+    return FakeNode(name, *inputs, native_input=True, native_output=False)
+
+
+class OptimizeTest(TestCase):
+    def setUp(self):
+        self.input = FakeNode("input")
+        self.gray = native_filter("gray", self.input)
+        self.binarize = native_filter("binarize", self.gray)
+        self.cleanup = native_filter("cleanup", self.binarize)
+        self.segment = FakeNode("segment", self.cleanup, native_input=True)
+
+    def test_native_chain(self):
+        """
+        Test filters feeding only Ocropus nodes pass native images.
+        """
+        recognizer = FakeNode("recognizer", self.cleanup, self.segment)
+        optimize.optimize(FakeScript(recognizer))
+        self.assertTrue(self.gray.native_output)
+        self.assertTrue(self.binarize.native_output)
+        # also read by the recognizer, so must be numpy
+        self.assertFalse(self.cleanup.native_output)
+
+    def test_ignored_consumer(self):
+        """
+        Test ignored nodes pass their input on to their consumers.
+        """
+        self.cleanup.ignored = True
+        recognizer = FakeNode("recognizer", self.cleanup, self.segment)
+        optimize.optimize(FakeScript(recognizer))
+        self.assertTrue(self.gray.native_output)
+        self.assertFalse(self.binarize.native_output)
+
+    def test_terminal(self):
+        """
+        Test a terminal filter always outputs numpy.
+        """
+        optimize.optimize(FakeScript(self.cleanup))
+        self.assertTrue(self.binarize.native_output)
+        self.assertFalse(self.cleanup.native_output)
+
+
+class FakeImageOp(FakeNode):
+    def __init__(self, name, input, op):
+        super(FakeImageOp, self).__init__(name, input)
+        self.op = op
+        self.fused = ()
+
+    def image_op(self):
+        return self.op
+
+    def fuse(self, nodes, input):
+        self.fused = tuple(nodes)
+        self._inputs[0] = input
+
+
+class FuseTest(TestCase):
+    def setUp(self):
+        self.input = FakeNode("input")
+        self.scale = FakeImageOp("scale", self.input, ("scale", 0.5))
+        self.crop = FakeImageOp("crop", self.scale, ("crop", 0, 0, 10, 10))
+        self.gray = FakeImageOp("gray", self.crop, ("gray",))
+
+    def test_fuse_run(self):
+        """
+        Test a run of image ops is fused into the last one.
+        """
+        output = FakeNode("output", self.gray)
+        optimize.optimize(FakeScript(output))
+        self.assertEqual(self.gray.fused, (self.scale, self.crop))
+        self.assertTrue(self.gray._inputs[0] is self.input)
+
+    def test_shared_output(self):
+        """
+        Test a node whose output is used elsewhere isn't fused away.
+        """
+        other = FakeNode("other", self.crop)
+        output = FakeNode("output", self.gray, other)
+        optimize.optimize(FakeScript(output))
+        self.assertEqual(self.crop.fused, (self.scale,))
+        self.assertEqual(self.gray.fused, ())
+        self.assertTrue(self.gray._inputs[0] is self.crop)
+
+    def test_decode_in_input(self):
+        """
+        Test the ops go to an input node which feeds only the run.
+        """
+        self.input.decode_for = lambda nodes: setattr(
+                self.input, "decoded_for", nodes)
+        output = FakeNode("output", self.gray)
+        optimize.optimize(FakeScript(output))
+        self.assertEqual(self.input.decoded_for, [self.gray])
+        self.assertTrue(self.gray.in_input)
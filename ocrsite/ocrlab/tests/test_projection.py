@@ -0,0 +1,35 @@
+"""
+    Test projection profile operations.
+"""
+import numpy
+from django.test import TestCase
+
+from ocrlab import projection
+
+
+class ProjectionTest(TestCase):
+    def test_high_pass(self):
+        """
+        Test values below the threshold are zeroed.
+        """
+        profile = numpy.array([0, 3, 10, 1, 7, 2])
+        self.assertEqual(list(projection.high_pass_max(profile, 0.25)),
+                [0, 3, 10, 0, 7, 0])
+        self.assertEqual(list(projection.high_pass_median(profile, 1.0)),
+                [0, 3, 10, 0, 7, 0])
+
+    def test_runs(self):
+        """
+        Test runs of non-zero values are found, including those
+        at either end of the profile.
+        """
+        self.assertEqual(projection.runs([1, 1, 0, 2, 0, 0, 3]).tolist(),
+                [[0, 2], [3, 4], [6, 7]])
+        self.assertEqual(projection.runs([0, 0]).tolist(), [])
+        self.assertEqual(projection.runs([]).tolist(), [])
+
+    def test_average_above(self):
+        """
+        Test values below the threshold are ignored.
+        """
+        self.assertEqual(projection.average_above([2, 10, 20, 30], 10), 20)
@@ -0,0 +1,79 @@
+"""
+    Test the cache of built preset scripts.
+"""
+import datetime
+from django.test import TestCase
+
+from ocrlab import scriptcache
+
+
+class FakePreset(object):
+    def __init__(self, pk, data):
+        self.pk = pk
+        self.data = data
+        self.updated_on = datetime.date(2012, 1, 1)
+
+
+class ScriptCacheTest(TestCase):
+    def setUp(self):
+        self.cache = scriptcache.ScriptCache(size=2, copies=2)
+        self.built = []
+
+    def build(self, preset):
+        script = (preset.pk, preset.data, len(self.built))
+        self.built.append(script)
+        return script
+
+    def run_task(self, preset):
+        with self.cache.script(preset, self.build) as script:
+            return script
+
+    def test_reuse(self):
+        """
+        Test a preset's script is only built once.
+        """
+        preset = FakePreset(1, u"{}")
+        self.assertEqual(self.run_task(preset), self.run_task(preset))
+        self.assertEqual(len(self.built), 1)
+
+    def test_changed(self):
+        """
+        Test a changed preset is rebuilt, even on the same day.
+        """
+        preset = FakePreset(1, u"{}")
+        self.run_task(preset)
+        preset.data = u'{"a": {}}'
+        self.assertEqual(self.run_task(preset)[1], u'{"a": {}}')
+        self.assertEqual(len(self.built), 2)
+        self.assertEqual(len(self.cache._scripts), 1)
+
+    def test_in_use(self):
+        """
+        Test a script in use isn't handed out again.
+        """
+        preset = FakePreset(1, u"{}")
+        with self.cache.script(preset, self.build) as first:
+            self.assertNotEqual(self.run_task(preset), first)
+        self.assertEqual(len(self.cache._scripts.values()[0]), 2)
+
+    def test_lru(self):
+        """
+        Test the least recently used preset is dropped.
+        """
+        presets = [FakePreset(i, u"{}") for i in range(3)]
+        for preset in presets + presets[2:]:
+            self.run_task(preset)
+        self.assertEqual([k[0] for k in self.cache._scripts], [1, 2])
+
+    def test_failed(self):
+        """
+        Test a script isn't reused after a task using it failed.
+        """
+        preset = FakePreset(1, u"{}")
+        try:
+            with self.cache.script(preset, self.build):
+                raise ValueError
+        except ValueError:
+            pass
+        self.run_task(preset)
+        self.assertEqual(len(self.built), 2)
@@ -0,0 +1,102 @@
+"""
+    Test running presets in tasks.
+"""
+import datetime
+from django.test import TestCase
+
+from ocrlab import scriptcache, stages, tasks
+
+
+class FakePreset(object):
+    pk = 1
+    data = u"{}"
+    updated_on = datetime.date(2012, 1, 1)
+
+
+class FakeNode(object):
+    outtype = unicode
+    progress_func = None
+    result_func = None
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._params = {}
+
+    def set_param(self, name, value):
+        self._params[name] = value
+
+    def eval(self):
+        if self.progress_func is not None:
+            self.progress_func(100, 100)
+        if self.result_func is not None:
+            self.result_func(u"text")
+        return u"text"
+
+
+class FakeScript(object):
+    def __init__(self):
+        self.input = FakeNode(stages.INPUT)
+        self.recognizer = FakeNode(stages.RECOGNIZE)
+
+    def get_nodes_by_attr(self, attr, value):
+        return [n for n in (self.input, self.recognizer)
+                if getattr(n, attr) == value]
+
+    def get_terminals(self):
+        return [self.recognizer]
+
+
+class OcrTaskTest(TestCase):
+    def setUp(self):
+        scriptcache.cache.clear()
+        self.script = FakeScript()
+        key, script = scriptcache.cache.checkout(FakePreset(),
+                lambda preset: self.script)
+        scriptcache.cache.checkin(key, script)
+
+    def tearDown(self):
+        scriptcache.cache.clear()
+
+    def test_no_stale_callbacks(self):
+        """
+        Test a task reusing a cached script isn't given the
+        callbacks of the task before it.
+        """
+        calls = []
+        result = tasks.OcrTask.run_preset(FakePreset(), "page1.png",
+                progress_func=lambda *args: calls.append("progress"),
+                result_func=calls.append)
+        self.assertEqual(result, u"text")
+        self.assertEqual(calls, ["progress", u"text"])
+        result = tasks.OcrTask.run_preset(FakePreset(), "page2.png")
+        self.assertEqual(result, u"text")
+        self.assertEqual(calls, ["progress", u"text"])
+        self.assertEqual(self.script.input._params["path"], "")
+        self.assertTrue(self.script.recognizer.progress_func is None)
+        self.assertTrue(self.script.recognizer.result_func is None)
+
+
+class OcrBatchTaskTest(TestCase):
+    def test_chunks(self):
+        """
+        Test inputs are split into chunks, keeping their index.
+        """
+        chunks = tasks.OcrBatchTask.get_chunks(["a", "b", "c"], 2)
+        self.assertEqual(chunks, [[(0, "a"), (1, "b")], [(2, "c")]])
+        self.assertEqual(tasks.OcrBatchTask.get_chunks([], 2), [])
+
+    def test_manifest(self):
+        """
+        Test chunk results are gathered in input order, whichever
+        chunk finishes first.
+        """
+        def result(index, error=None):
+            return dict(index=index, path="%d.png" % index,
+                    result=None if error else u"text", error=error)
+        chunks = [[result(2), result(3, "IOError: missing")],
+                [result(0), result(1)]]
+        manifest = tasks.OcrBatchManifestTask().run(chunks)
+        self.assertEqual(manifest["count"], 4)
+        self.assertEqual(manifest["failed"], 1)
+        self.assertEqual([r["index"] for r in manifest["results"]],
+                [0, 1, 2, 3])
@@ -0,0 +1,53 @@
+"""
+    Test tiled image processing.
+"""
+import numpy
+from django.test import TestCase
+
+from ocrlab import tiling
+
+
+def local_max(image):
+    """Max over each pixel's 3x3 neighbourhood."""
+    out = image.copy()
+    h, w = image.shape
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            src = (slice(max(0, dy), h + min(0, dy)),
+                    slice(max(0, dx), w + min(0, dx)))
+            dst = (slice(max(0, -dy), h + min(0, -dy)),
+                    slice(max(0, -dx), w + min(0, -dx)))
+            out[dst] = numpy.maximum(out[dst], image[src])
+    return out
+
+
+class TilingTest(TestCase):
+    def setUp(self):
+        self.image = numpy.random.RandomState(0).randint(
+                0, 255, (103, 77)).astype(numpy.uint8)
+
+    def test_tiles_cover_image(self):
+        """
+        Test each pixel is in exactly one kept tile area.
+        """
+        count = numpy.zeros(self.image.shape, dtype=int)
+        for source, keep, dest in tiling.get_tiles(self.image.shape, 20, 5):
+            count[dest] += 1
+        self.assertTrue((count == 1).all())
+
+    def test_same_as_whole_page(self):
+        """
+        Test tiled results match processing the whole image,
+        given a big enough halo.
+        """
+        expected = local_max(self.image)
+        for size, workers in ((16, 1), (40, 3), (500, 2)):
+            self.assertTrue((tiling.run_tiled(local_max, self.image,
+                    size, halo=1, workers=workers) == expected).all())
+
+    def test_shape_check(self):
+        """
+        Test operations which resize tiles are rejected.
+        """
+        self.assertRaises(ValueError, tiling.run_tiled,
+                lambda tile: tile[1:], self.image, 20, 2)
@@ -0,0 +1,45 @@
+"""
+    Test node input/output types.
+"""
+import io
+import json
+from django.test import TestCase
+
+from ocrlab.types import Segmentation
+
+
+class SegmentationTest(TestCase):
+    def setUp(self):
+        self.seg = Segmentation(bbox=[0, 0, 50, 100],
+                lines=[(10, 20, 40, 30), (10, 35, 40, 45)],
+                columns=[[5, 5, 45, 95]])
+
+    def test_boxes(self):
+        """
+        Test every kind of box is an N x 4 array.
+        """
+        self.assertEqual(self.seg["lines"].shape, (2, 4))
+        self.assertEqual(self.seg["paragraphs"].shape, (0, 4))
+        self.assertEqual(self.seg.flipud(100)["lines"].tolist(),
+                [[10, 70, 40, 80], [10, 55, 40, 65]])
+        self.assertEqual(self.seg.clip(30, 40)["lines"].tolist(),
+                [[10, 20, 30, 30], [10, 35, 30, 40]])
+
+    def test_save_and_load(self):
+        """
+        Test the binary cache format round-trips, and a JSON-able
+        dict can be had.
+        """
+        handle = io.BytesIO()
+        self.seg.save(handle)
+        handle.seek(0)
+        loaded = Segmentation.load(handle)
+        self.assertEqual(loaded.to_dict(), self.seg.to_dict())
+        self.assertEqual(loaded.to_dict()["columns"], [[5, 5, 45, 95]])
+
+    def test_to_dict(self):
+        """
+        Test segmentations can be handed out as JSON.
+        """
+        data = json.loads(json.dumps(self.seg.to_dict()))
+        self.assertEqual(data["columns"], [[5, 5, 45, 95]])
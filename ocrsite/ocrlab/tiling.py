@@ -0,0 +1,59 @@
+"""
+Run image operations over overlapping tiles of a page rather than
+the whole page at once, to bound the memory they need.  Each tile
+is extended by a halo of surrounding pixels, so that operations
+which look at a neighbourhood (i.e. adaptive thresholding) give
+the same result at tile edges, and only the middle of each
+processed tile is kept.
+"""
+
+import threading
+
+import numpy
+
+from . import utils
+
+
+# Default halo, in pixels, which should be at least the radius of
+# the largest window the operation uses.
+DEFAULT_HALO = 64
+
+
+def get_tiles(shape, size, halo=DEFAULT_HALO):
+    """Get the tiles covering a 2D array of the given shape, as
+    tuples of slices: (source, keep, dest).  source is the tile
+    plus its halo in the array, keep is the part of the tile's
+    result to keep, and dest is where that goes in the output."""
+    def spans(length):
+        for start in range(0, length, size):
+            stop = min(start + size, length)
+            outer = max(0, start - halo), min(length, stop + halo)
+            yield (slice(*outer), slice(start - outer[0], stop - outer[0]),
+                    slice(start, stop))
+    for ysource, ykeep, ydest in spans(shape[0]):
+        for xsource, xkeep, xdest in spans(shape[1]):
+            yield ((ysource, xsource), (ykeep, xkeep), (ydest, xdest))
+
+
+def run_tiled(func, image, size, halo=DEFAULT_HALO, workers=1):
+    """Apply func to overlapping tiles of image and stitch the
+    results together.  func must return an array with the same
+    height and width as the tile it's given.  Tiles are passed as
+    contiguous copies; up to workers of them are processed at a
+    time, in threads."""
+    lock = threading.Lock()
+    out = []
+    def run(tile):
+        source, keep, dest = tile
+        part = numpy.ascontiguousarray(image[source])
+        result = numpy.asarray(func(part))
+        if result.shape[:2] != part.shape[:2]:
+            raise ValueError("Tiled operation changed tile shape from "
+                    "%s to %s" % (part.shape[:2], result.shape[:2]))
+        with lock:
+            if not out:
+                out.append(numpy.empty(image.shape[:2] + result.shape[2:],
+                        dtype=result.dtype))
+        out[0][dest] = result[keep]
+    utils.parallel_map(run, get_tiles(image.shape, size, halo), workers)
+    return out[0] if out else numpy.array(image, copy=True)
@@ -2,5 +2,94 @@
 Custom types for node input/output.
 """
 
+import numpy
+
+
 class HocrString(unicode):
     pass
+
+
+class Segmentation(dict):
+    """The result of segmenting a page: an int32 N x 4 array of
+    (x0, y0, x1, y1) boxes, in top-origin page coords, for each
+    kind of region, plus (optionally) the page bbox."""
+    kinds = ("columns", "lines", "paragraphs")
+
+    def __init__(self, data=None, **kwargs):
+        super(Segmentation, self).__init__()
+        for kind in self.kinds:
+            self[kind] = None
+        if data is not None:
+            kwargs = dict(data, **kwargs)
+        for key, value in kwargs.iteritems():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if key in self.kinds:
+            value = numpy.asarray(value if value is not None else [],
+                    dtype=numpy.int32).reshape(-1, 4)
+        super(Segmentation, self).__setitem__(key, value)
+
+    def copy(self):
+        return Segmentation(self)
+
+    def map(self, func):
+        """Get a new segmentation with func applied to each
+        kind's box array."""
+        out = self.copy()
+        for kind in self.kinds:
+            out[kind] = func(self[kind])
+        return out
+
+    def flipud(self, height):
+        """Flip every box between top- and bottom-origin coords
+        in a page of the given height."""
+        return self.map(lambda boxes: numpy.column_stack((boxes[:, 0],
+                height - boxes[:, 3], boxes[:, 2], height - boxes[:, 1])))
+
+    def offset(self, dx, dy):
+        """Move every box by dx, dy."""
+        return self.map(lambda boxes: boxes + [dx, dy, dx, dy])
+
+    def clip(self, width, height):
+        """Clip every box to the given page size."""
+        def clip(boxes):
+            boxes = boxes.copy()
+            numpy.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+            numpy.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+            return boxes
+        return self.map(clip)
+
+    @classmethod
+    def concatenate(cls, segmentations):
+        """Join segmentations (i.e. of regions of a page) into one,
+        keeping their order."""
+        out = cls()
+        for kind in cls.kinds:
+            arrays = [seg[kind] for seg in segmentations]
+            if arrays:
+                out[kind] = numpy.concatenate(arrays)
+        return out
+
+    def to_dict(self):
+        """Get a plain dict of lists, i.e. for JSON."""
+        return dict((key, value.tolist() if hasattr(value, "tolist")
+                else value) for key, value in self.iteritems())
+
+    def save(self, handle):
+        """Write the segmentation to a file in numpy's npz format."""
+        arrays = dict((key, numpy.asarray(value))
+                for key, value in self.iteritems() if value is not None)
+        numpy.savez_compressed(handle, **arrays)
+
+    @classmethod
+    def load(cls, handle):
+        """Read a segmentation written by save."""
+        npz = numpy.load(handle)
+        try:
+            data = dict((key, npz[key]) for key in npz.files)
+        finally:
+            npz.close()
+        if "bbox" in data:
+            data["bbox"] = data["bbox"].tolist()
+        return cls(data)
@@ -22,6 +22,8 @@ urlpatterns = patterns('',
     url(r'^$', views.home, name="home"),
     url(r'^progress/(?P<task_id>[a-z0-9-]+)/?$',
             views.progress, name='ocr_progress'),
+    url(r'^progress/(?P<task_id>[a-z0-9-]+)/lines/?$',
+            views.partial_results, name='ocr_partial_results'),
 
     url(r'^presets/?$', ListView.as_view(
             model=models.Preset,
@@ -5,10 +5,13 @@ Useful functions and classes for nodes to use.
 import os
 import re
 import tempfile
+import multiprocessing
 import subprocess as sp
+from multiprocessing.pool import ThreadPool
+import numpy
 from lxml import etree
 from HTMLParser import HTMLParser
-from . import cache, exceptions
+from . import exceptions, hocr
 
 
 class HTMLContentHandler(HTMLParser):
@@ -95,21 +98,38 @@ class HocrToTextHelper(HTMLParser):
         self._gotline = False
 
 
-def merge_hocr(hocrlist):
+def merge_hocr(hocrlist, offsets=None, bbox=None):
     """Merge several HOCR files (i.e. representing
     individual columns) into one page file."""
-    raise NotImplementedError
+    if offsets is None:
+        offsets = [(0, 0)] * len(hocrlist)
+    return hocr.merge_columns(hocrlist, offsets, dict(bbox=bbox))
+
+
+def parallel_map(func, items, workers=None):
+    """Map func over items with a pool of threads, returning the
+    results in order.  Threads are used rather than processes since
+    Celery's prefork children can't start their own, and the heavy
+    lifting is done by external tools or native code."""
+    items = list(items)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return map(func, items)
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
 
 
 def hocr_from_data(pagedata):
     """
     Return an HOCR document (as a string).
     """
-    from django.template import Template, Context
-    with open(os.path.join(os.path.dirname(__file__), 
-            "templates", "hocr_template.html"), "r") as tmpl:
-        t = Template(tmpl.read())
-        return unicode(t.render(Context(pagedata)))
+    return hocr.hocr_from_data(pagedata)
 
 
 def hocr_from_abbyy(abbyyxml):
@@ -124,6 +144,57 @@ def hocr_from_abbyy(abbyyxml):
             return unicode(transform(xml))
 
 
+def get_boxes(boxes, kind):
+    """Get the boxes of the given kind from a segmentation
+    as an N x 4 integer array."""
+    return numpy.asarray(boxes.get(kind, []),
+            dtype=numpy.int32).reshape(-1, 4)
+
+
+def get_region_boxes(regions):
+    """Get the (x0, y0, x1, y1) of every region in an Ocropus
+    RegionExtractor as an N x 4 array.  Region 0 is the
+    background and is skipped."""
+    count = max(0, regions.length() - 1)
+    boxes = numpy.empty((count, 4), dtype=numpy.int32)
+    for i in range(count):
+        boxes[i] = (regions.x0(i + 1), regions.y0(i + 1),
+                regions.x1(i + 1), regions.y1(i + 1))
+    return boxes
+
+
+def clip_boxes(coords, width, height):
+    """Clip an N x 4 array of boxes to the given page size."""
+    clipped = coords.copy()
+    numpy.clip(clipped[:, 0::2], 0, width, out=clipped[:, 0::2])
+    numpy.clip(clipped[:, 1::2], 0, height, out=clipped[:, 1::2])
+    return clipped
+
+
+class BufferPool(object):
+    """Hands out C-contiguous arrays backed by a recycled buffer
+    (one per dtype) which grows as needed.  An array obtained from
+    the pool is only valid until the next call to get()."""
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, shape, dtype):
+        """Get an uninitialised contiguous array."""
+        dtype = numpy.dtype(dtype)
+        size = int(numpy.prod(shape))
+        buf = self._buffers.get(dtype)
+        if buf is None or buf.size < size:
+            buf = numpy.empty(size, dtype=dtype)
+            self._buffers[dtype] = buf
+        return buf[:size].reshape(shape)
+
+    def copy(self, arr):
+        """Copy an array (i.e. a view) into a pooled buffer."""
+        out = self.get(arr.shape, arr.dtype)
+        out[...] = arr
+        return out
+
+
 def get_cacher(settings):
     cache_path = settings.NODETREE_PERSISTANT_CACHER.split('.')
     # Allow for Python 2.5 relative paths
@@ -137,6 +208,9 @@ def get_cacher(settings):
 
 
 def get_dzi_cacher(settings):
+    # the cachers need pymongo and friends, so
+    # they're only imported when wanted
+    from . import cache
     try:
         cachebase = get_cacher(settings)
         cacher = cache.DziFileCacher
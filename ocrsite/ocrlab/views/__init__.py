@@ -9,6 +9,7 @@ from celery import result
 from .presets import *
 
 from ocrlab import forms, models, tasks
+from ocrlab.results import ResultChannel
 
 
 
@@ -37,7 +38,14 @@ def home(request):
                 temppath = save_to_temp(form.cleaned_data["file"])
                 async = tasks.OcrTask.delay(preset.id, temppath)
                 return redirect("ocr_progress", task_id=async.task_id)
+            # input nodes read the upload directly: from memory if
+            # it was small enough to be kept there, otherwise from
+            # the temporary file Django already wrote
             res = tasks.OcrTask.run_preset(preset, form.cleaned_data["file"])
+            if isinstance(res, (dict, list)):
+                # i.e. a segmentation
+                return HttpResponse(json.dumps(res),
+                        mimetype="application/json")
             response = HttpResponse()
             response.write(res)
             return response
@@ -62,4 +70,18 @@ def progress(request, task_id):
     return render(request, template, context)
 
 
-
+def partial_results(request, task_id):
+    """Long-poll for lines recognized by a running task after
+    the first 'since', returned as JSON.  Once the task has
+    finished there are no more to come, even if its lines have
+    expired or it never published any."""
+    try:
+        since = max(0, int(request.GET.get("since", 0)))
+        wait = min(30.0, max(0.0, float(request.GET.get("wait", 20))))
+    except ValueError:
+        since, wait = 0, 20.0
+    channel = ResultChannel(task_id)
+    lines = channel.poll(since, timeout=wait)
+    done = channel.closed() or result.AsyncResult(task_id).ready()
+    data = dict(lines=lines, next=since + len(lines), done=done)
+    return HttpResponse(json.dumps(data), mimetype="application/json")
@@ -227,6 +227,15 @@ DEBUG_TOOLBAR_CONFIG = {
     "INTERCEPT_REDIRECTS": False,
 }
 
+# Recognition models to load when a Celery worker starts, as
+# (node type, parameters) pairs, e.g.
+# ("ocropus.OcropusRecognizer", {"language_model": "english.fst"})
+OCRLAB_PRELOAD_MODELS = []
+
+# Number of inputs each worker processes in turn in a batch task,
+# sharing the preset's script and models.
+OCRLAB_BATCH_CHUNK_SIZE = 10
+
 # local_settings.py can be used to override environment-specific settings
 # like database and email that differ between development and production.
 try: